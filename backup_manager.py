@@ -1,17 +1,36 @@
 import os
 import subprocess
 import datetime
+import time
 from PyQt5.QtCore import pyqtSignal, QObject
-import threading
+import shutil
+from git_store import Git_Store
+from utils import CREATE_NO_WINDOW
+from snapshot import World_Snapshot
+from catalog import Backup_Catalog
+from maintenance import Repo_Maintenance
+from retention import Retention_Policy
+from scheduler import Task_Scheduler
+from change_tracker import World_Change_Tracker, Observer
 
 ROLE = "Backup Manager"
+DIMENSIONS = {
+    "overworld": "",
+    "minecraft:overworld": "",
+    "nether": "DIM-1",
+    "the_nether": "DIM-1",
+    "minecraft:the_nether": "DIM-1",
+    "end": "DIM1",
+    "the_end": "DIM1",
+    "minecraft:the_end": "DIM1",
+}
 
 
 class Backup_Manager(QObject):
     sig_out = pyqtSignal(str)
-    sig_task_done = pyqtSignal()
+    sig_snapshot_done = pyqtSignal()
 
-    def __init__(self, settings):
+    def __init__(self, settings, limiter=None, executor=None):
         super().__init__()
         relative_src_dir=settings.get("src_dir")
         relative_git_dir=settings.get("git_dir")
@@ -29,6 +48,60 @@ class Backup_Manager(QObject):
         self.backup_prefix = settings.get("backup_prefix", "backup_")
         self.tagged_backup_prefix = settings.get("tagged_backup_prefix", "tag_")
         self.backup_timestamp_format = settings.get("backup_timestamp_format", "%Y%m%d%H%M%S")
+        self.backup_engine = settings.get("backup_engine", "fast-import")
+        self.backup_snapshot = settings.get("backup_snapshot", True)
+        self.snapshot = World_Snapshot(
+            os.path.abspath(settings.get("snapshot_dir", self.src_dir + ".snapshot"))
+        )
+        self.incremental_index = settings.get("incremental_index", True)
+        self.git_fsmonitor = settings.get("git_fsmonitor", False)
+        self.repo_configured = False
+        self.staging_dir = os.path.abspath(
+            settings.get("restore_staging_dir", self.src_dir + ".staging")
+        )
+        self.rollback_dir = os.path.abspath(
+            settings.get("restore_rollback_dir", self.src_dir + ".rollback")
+        )
+        self.pending_swap = None
+        self.scheduler = Task_Scheduler(limiter)
+        self.maintenance = Repo_Maintenance(
+            self.git_dir,
+            threads=settings.get("maintenance_threads", 1),
+            window_memory=settings.get("maintenance_window_memory", "256m"),
+            batch_size=settings.get("maintenance_batch_size", "2g"),
+        )
+        self.retention = Retention_Policy(settings.get("retention"))
+        self.retention_interval = settings.get("retention_interval", 86400)
+        self.last_prune_time = 0
+        self.catalog = Backup_Catalog(
+            self.git_dir, self.backup_prefix, self.tagged_backup_prefix
+        )
+        self.store = Git_Store(
+            self.git_dir,
+            region_dedup=settings.get("region_dedup", True),
+            workers=settings.get("backup_workers", min(4, os.cpu_count() or 1)),
+            io_concurrency=settings.get("backup_io_concurrency", 4),
+            compression_level=settings.get("backup_compression_level", 1),
+            executor=executor,
+        )
+        self.change_tracker = World_Change_Tracker(
+            self.src_dir, self.store, watch=settings.get("world_watcher", False)
+        )
+
+    def start_change_tracker(self):
+        if not self.change_tracker.watch or self.change_tracker.is_watching():
+            return
+        if Observer == None:
+            self.out(ROLE, "WARN", "watchdog is not installed, world changes will be detected by scanning")
+        elif not self.change_tracker.start():
+            self.out(ROLE, "WARN", "Failed to watch the world folder, world changes will be detected by scanning")
+
+    def world_changed(self):
+        try:
+            files, changed = self.change_tracker.changes()
+        except (subprocess.CalledProcessError, OSError):
+            return True
+        return len(changed) > 0
 
     def get_commits_hash_by_msg_prefix(self, commit_prefix):
         try:
@@ -43,7 +116,7 @@ class Backup_Manager(QObject):
                     "--pretty=format:%H",
                 ],
                 text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+                creationflags=CREATE_NO_WINDOW,
             )
             commits_hash = output.split("\n")
             return commits_hash
@@ -63,7 +136,7 @@ class Backup_Manager(QObject):
                     "--pretty=format:%s",
                 ],
                 text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+                creationflags=CREATE_NO_WINDOW,
             )
             commits_message = output.split("\n")
             return commits_message
@@ -71,6 +144,9 @@ class Backup_Manager(QObject):
             self.out(ROLE, "ERROR", f"Get commits by message prefix failed: {str(e)}")
 
     def get_commit_hash_by_msg(self, commit_message):
+        commit_hash = self.catalog.find(commit_message)
+        if commit_hash != None:
+            return commit_hash
         try:
             output = subprocess.check_output(
                 [
@@ -85,9 +161,9 @@ class Backup_Manager(QObject):
                     "--pretty=format:%H",
                 ],
                 text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+                creationflags=CREATE_NO_WINDOW,
             )
-            commits_hash = output.split("\n")
+            commits_hash = [line for line in output.split("\n") if line]
             if len(commits_hash) == 0:
                 self.out(ROLE, "WARN", f"Can't find commit: {commit_message}")
                 return None
@@ -96,6 +172,40 @@ class Backup_Manager(QObject):
         except subprocess.CalledProcessError as e:
             self.out(ROLE, "ERROR", f"Get the commit by message failed: {str(e)}")
 
+    def configure_repo(self):
+        if self.repo_configured:
+            return
+        options = {}
+        if self.incremental_index:
+            options["core.untrackedCache"] = "true"
+            options["index.version"] = "4"
+            options["core.checkStat"] = "minimal"
+            options["core.trustctime"] = "false"
+            options["core.fsmonitor"] = "true" if self.git_fsmonitor else "false"
+        for key, value in options.items():
+            subprocess.run(
+                ["git", "--git-dir", self.git_dir, "config", key, value],
+                check=True,
+                creationflags=CREATE_NO_WINDOW,
+            )
+        self.repo_configured = True
+
+    def ensure_catalog(self):
+        if self.catalog.is_empty() and self.store.resolve("HEAD") != None:
+            self.rebuild_catalog()
+
+    def rebuild_catalog(self):
+        self.out(ROLE, "INFO", "Rebuilding backup catalog...")
+        try:
+            count = self.catalog.rebuild()
+            self.out(ROLE, "INFO", f"Backup catalog rebuilt with {count} backups")
+        except subprocess.CalledProcessError as e:
+            self.out(ROLE, "ERROR", f"Rebuild backup catalog failed: {str(e)}")
+
+    def list_backups(self, prefix=None, since=None, until=None, limit=None, offset=0):
+        self.ensure_catalog()
+        return self.catalog.list(prefix, since, until, limit, offset)
+
     def backup_timestamp(self):
         return datetime.datetime.now().strftime(self.backup_timestamp_format)
 
@@ -105,70 +215,101 @@ class Backup_Manager(QObject):
 
     def new_commit(self, commit_msg):
         self.out(ROLE, "INFO", f"Starting backup: {commit_msg}")
-        if not os.path.exists(self.git_dir):
-            os.makedirs(self.git_dir)
         try:
-            ignore_file = os.path.join(self.src_dir, ".gitignore")
-            attribute_file = os.path.join(self.src_dir, ".gitattributes")
-            with open(ignore_file, "w") as f:
-                f.write("*.lock\n")
-            with open(attribute_file, "w") as f:
-                f.write("* binary\n")
-            if not os.path.exists(os.path.join(self.git_dir, "HEAD")):
-                subprocess.run(
-                    ["git", "init", "--bare"],
-                    cwd=self.git_dir,
-                    check=True,
-                    creationflags=subprocess.CREATE_NO_WINDOW,
+            root = self.src_dir
+            files, changed = self.change_tracker.changes()
+            if self.backup_snapshot:
+                self.scheduler.progress(0, 2, "Taking snapshot")
+                root, files = self.take_snapshot(files)
+            self.ensure_catalog()
+            self.scheduler.progress(1, 2, "Writing commit")
+            if self.backup_engine == "fast-import":
+                result = self.store.write_commit(root, commit_msg, files=files)
+                self.out(
+                    ROLE,
+                    "INFO",
+                    f"Backup completed: {commit_msg} "
+                    f"({result['changed']} of {result['files']} files changed)",
                 )
-            subprocess.run(
-                [
-                    "git",
-                    "--git-dir",
-                    self.git_dir,
-                    "--work-tree",
-                    self.src_dir,
-                    "reset"
-                ],
-                check=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-            )
-            subprocess.run(
-                [
-                    "git",
-                    "--git-dir",
-                    self.git_dir,
-                    "--work-tree",
-                    self.src_dir,
-                    "add",
-                    "--all",
-                ],
-                check=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+            else:
+                self.new_commit_with_index(root, commit_msg)
+                result = {
+                    "commit": self.store.resolve("HEAD"),
+                    "files": len(files),
+                    "size": sum(entry[1] for entry in files.values()),
+                }
+                self.out(ROLE, "INFO", f"Backup completed: {commit_msg}")
+            self.catalog.add(
+                result["commit"],
+                commit_msg,
+                int(time.time()),
+                result["size"],
+                result["files"],
             )
+            return result
+        except subprocess.CalledProcessError as e:
+            self.out(ROLE, "ERROR", f"Backup failed: {str(e)}")
+        except OSError as e:
+            self.out(ROLE, "ERROR", f"Backup failed: {str(e)}")
+
+    def take_snapshot(self, files):
+        start = datetime.datetime.now()
+        stats = self.snapshot.take(self.src_dir, files)
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+        self.sig_snapshot_done.emit()
+        self.out(
+            ROLE,
+            "INFO",
+            f"Snapshot taken in {elapsed:.1f}s "
+            f"({stats['linked']} linked, {stats['cloned']} cloned, {stats['copied']} copied)",
+        )
+        taken = self.snapshot.load_manifest()
+        return self.snapshot.current_dir, {path: entry for path, entry in files.items() if path in taken}
+
+    def new_commit_with_index(self, root, commit_msg):
+        self.store.init()
+        self.configure_repo()
+        if not self.incremental_index:
             subprocess.run(
                 [
                     "git",
                     "--git-dir",
                     self.git_dir,
                     "--work-tree",
-                    self.src_dir,
-                    "commit",
-                    "-m",
-                    commit_msg,
+                    root,
+                    "reset"
                 ],
                 check=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+                creationflags=CREATE_NO_WINDOW,
             )
-            self.out(ROLE, "INFO", f"Backup completed: {commit_msg}")
-
-        except subprocess.CalledProcessError as e:
-            self.out(ROLE, "ERROR", f"Backup failed: {str(e)}")
-        finally:
-            if os.path.exists(ignore_file):
-                os.remove(ignore_file)
-            if os.path.exists(attribute_file):
-                os.remove(attribute_file)
+        subprocess.run(
+            [
+                "git",
+                "--git-dir",
+                self.git_dir,
+                "--work-tree",
+                root,
+                "add",
+                "--all",
+            ],
+            check=True,
+            creationflags=CREATE_NO_WINDOW,
+        )
+        subprocess.run(
+            [
+                "git",
+                "--git-dir",
+                self.git_dir,
+                "--work-tree",
+                root,
+                "commit",
+                "--allow-empty",
+                "-m",
+                commit_msg,
+            ],
+            check=True,
+            creationflags=CREATE_NO_WINDOW,
+        )
 
     def clean(self):
         self.out(ROLE, "INFO", f"Cleaning git repo...")
@@ -184,67 +325,235 @@ class Backup_Manager(QObject):
                     "--all",
                 ],
                 check=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+                creationflags=CREATE_NO_WINDOW,
             )
             subprocess.run(
                 ["git", "--git-dir", self.git_dir, "gc", "--prune=now", "--aggressive"],
                 check=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
+                creationflags=CREATE_NO_WINDOW,
             )
             self.out(ROLE, "INFO", f"Cleaned git repo")
         except subprocess.CalledProcessError as e:
             self.out(ROLE, "ERROR", f"Clean git repo failed: {str(e)}")
 
-    def run_task(self, f, args=()):
-        def thread_task():
-            try:
-                f(*args)
-            except Exception as e:
-                print(f"Error in thread_task: {e}")
-            finally:
-                self.sig_task_done.emit()
+    def prune_backups(self, dry_run=False):
+        if not self.retention.enabled:
+            self.out(ROLE, "WARN", 'Retention is disabled, set "enabled" in "retention" in config.json')
+            return
+        if not self.retention.is_enabled():
+            self.out(ROLE, "WARN", 'No retention rules, please add "retention" in config.json')
+            return
+        self.last_prune_time = time.time()
+        try:
+            self.ensure_catalog()
+            backups = self.catalog.list()
+            expired = self.retention.select(backups, int(time.time()))
+            if len(expired) == 0:
+                self.out(ROLE, "INFO", "No backups expired")
+                return
+            if dry_run:
+                out_str = f"{len(expired)} of {len(backups)} backups would be pruned:\n"
+                for backup in expired:
+                    out_str += f"\t{backup['name']}\n"
+                self.out(ROLE, "INFO", out_str)
+                return
+            self.out(ROLE, "INFO", f"Pruning {len(expired)} of {len(backups)} backups...")
+            pruned, rewritten = self.store.rewrite_history(backup["hash"] for backup in expired)
+            self.catalog.apply_rewrite(pruned, rewritten)
+            if len(pruned) > 0:
+                self.maintenance.request_prune()
+            self.out(
+                ROLE,
+                "INFO",
+                f"Pruned {len(pruned)} backups, space will be reclaimed by the next repository maintenance",
+            )
+        except subprocess.CalledProcessError as e:
+            self.out(ROLE, "ERROR", f"Prune backups failed: {str(e)}")
+
+    def maintain(self):
+        self.out(ROLE, "INFO", "Starting repository maintenance...")
+        finished = False
+        try:
+            finished = self.maintenance.run(self.when_maintenance_progress)
+            if finished:
+                self.out(ROLE, "INFO", "Repository maintenance finished")
+            else:
+                self.out(ROLE, "INFO", "Repository maintenance cancelled")
+        except subprocess.CalledProcessError as e:
+            self.out(ROLE, "ERROR", f"Repository maintenance failed: {str(e)}")
+        return finished
 
-        thread = threading.Thread(target=thread_task)
-        thread.start()
+    def when_maintenance_progress(self, step, total, name, percent):
+        if percent == None and step < total:
+            self.out(ROLE, "INFO", f"Maintenance step {step + 1}/{total}: {name}")
+        self.scheduler.progress(step, total, name, -1 if percent == None else percent)
 
     def new_auto_backup(self):
         new_backup_name = self.backup_prefix + self.backup_timestamp()
-        self.new_commit(new_backup_name)
+        result = self.new_commit(new_backup_name)
+        if (
+            self.retention.is_enabled()
+            and time.time() - self.last_prune_time >= self.retention_interval
+        ):
+            self.prune_backups()
+        return result
 
     def new_tagged_backup(self, tag):
         new_backup_name = self.tagged_backup_prefix + tag
-        self.new_commit(new_backup_name)
+        return self.new_commit(new_backup_name)
 
     def when_about_to_quit(self):
-        self.sig_out.disconnect()
-        self.sig_task_done.disconnect()
+        self.change_tracker.stop()
+        self.store.close()
+        for signal in (
+            self.sig_out,
+            self.sig_snapshot_done,
+            self.scheduler.sig_task_started,
+            self.scheduler.sig_task_progress,
+            self.scheduler.sig_task_done,
+        ):
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass
 
     def new_branch(self, commit_msg):
         self.out(ROLE, "INFO", f"Rolling back to: {commit_msg}...")
         try:
-            os.makedirs(self.src_dir, exist_ok=True)
             commit_hash = self.get_commit_hash_by_msg(commit_msg)
+            if commit_hash == None:
+                return
             branch_name = self.backup_timestamp() + "_to_" + commit_msg
-            command = [
-                "git",
-                "--git-dir",
-                self.git_dir,
-                "--work-tree",
-                self.src_dir,
-                "checkout",
-                "-b",
-                branch_name,
-                commit_hash,
-                "--force",
-            ]
-
-            subprocess.run(
-                command, check=True, creationflags=subprocess.CREATE_NO_WINDOW
-            )
+            result = self.store.materialize(commit_hash, self.src_dir)
+            self.store.switch_branch(branch_name, commit_hash, result["manifest"])
             self.out(
                 ROLE,
                 "INFO",
                 f"Created branch {branch_name} from {commit_msg} and switched to new branch",
             )
+            return result
         except subprocess.CalledProcessError as e:
             self.out(ROLE, "ERROR", f"Rollback failed: {str(e)}")
+
+    def stage_restore(self, commit_msg):
+        self.pending_swap = None
+        self.out(ROLE, "INFO", f"Staging rollback to: {commit_msg}...")
+        try:
+            commit_hash = self.get_commit_hash_by_msg(commit_msg)
+            if commit_hash == None:
+                return
+            if os.path.exists(self.staging_dir):
+                shutil.rmtree(self.staging_dir)
+            result = self.store.materialize(commit_hash, self.staging_dir)
+            branch_name = self.backup_timestamp() + "_to_" + commit_msg
+            self.pending_swap = (branch_name, commit_hash, result["manifest"], commit_msg)
+            self.out(ROLE, "INFO", f"Staged {result['files']} files from {commit_msg}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            self.out(ROLE, "ERROR", f"Staging rollback failed: {str(e)}")
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def swap_staged_restore(self):
+        if self.pending_swap == None:
+            return
+        branch_name, commit_hash, manifest, commit_msg = self.pending_swap
+        self.pending_swap = None
+        try:
+            if os.path.exists(self.rollback_dir):
+                shutil.rmtree(self.rollback_dir)
+            if os.path.exists(self.src_dir):
+                os.rename(self.src_dir, self.rollback_dir)
+            os.rename(self.staging_dir, self.src_dir)
+            self.change_tracker.reset()
+            self.store.switch_branch(branch_name, commit_hash, manifest)
+            self.out(
+                ROLE,
+                "INFO",
+                f"Created branch {branch_name} from {commit_msg} and switched to new branch, "
+                f"previous world kept in {self.rollback_dir}",
+            )
+        except (subprocess.CalledProcessError, OSError) as e:
+            if not os.path.exists(self.src_dir) and os.path.exists(self.rollback_dir):
+                os.rename(self.rollback_dir, self.src_dir)
+            self.out(ROLE, "ERROR", f"Rollback failed: {str(e)}")
+
+    def restore_partial(self, commit_msg, option):
+        try:
+            paths, chunk_areas = self.partial_targets(option)
+        except ValueError as e:
+            self.out(ROLE, "WARN", f"Invalid partial rollback option: {str(e)}")
+            return
+        self.out(ROLE, "INFO", f"Partially rolling back to: {commit_msg}...")
+        try:
+            commit_hash = self.get_commit_hash_by_msg(commit_msg)
+            if commit_hash == None:
+                return
+            if paths:
+                result = self.store.extract_paths(commit_hash, self.src_dir, paths)
+                self.out(
+                    ROLE,
+                    "INFO",
+                    f"Restored {result['files']} files and removed {result['removed']} files from {commit_msg}",
+                )
+            for dimension, chunk_from, chunk_to in chunk_areas:
+                result = self.store.extract_chunks(
+                    commit_hash, self.src_dir, dimension, chunk_from, chunk_to
+                )
+                self.out(
+                    ROLE,
+                    "INFO",
+                    f"Restored {result['replaced']} chunks and removed {result['removed']} chunks from {commit_msg}",
+                )
+        except subprocess.CalledProcessError as e:
+            self.out(ROLE, "ERROR", f"Partial rollback failed: {str(e)}")
+
+    def partial_targets(self, option):
+        if not isinstance(option, dict):
+            raise ValueError("expected an object")
+        paths = option.get("paths", [])
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError('"paths" must be a list of strings')
+        paths = list(paths)
+        for dimension, (from_x, from_z), (to_x, to_z) in self.areas(option.get("regions"), "regions"):
+            for folder in ("region", "entities", "poi"):
+                for region_x in range(min(from_x, to_x), max(from_x, to_x) + 1):
+                    for region_z in range(min(from_z, to_z), max(from_z, to_z) + 1):
+                        paths.append(
+                            f"{dimension}{folder}/r.{region_x}.{region_z}.mca".lstrip("/")
+                        )
+        return paths, self.areas(option.get("chunks"), "chunks")
+
+    def areas(self, option, key):
+        if option == None:
+            return []
+        if isinstance(option, dict):
+            option = [option]
+        if not isinstance(option, list):
+            raise ValueError(f'"{key}" must be an object or a list of objects')
+        areas = []
+        for area in option:
+            if not isinstance(area, dict) or "from" not in area:
+                raise ValueError(f'every entry of "{key}" needs a "from" coordinate')
+            dimension = area.get("dimension", "overworld")
+            if not isinstance(dimension, str):
+                raise ValueError(f'"dimension" in "{key}" must be a string')
+            areas.append(
+                (
+                    self.dimension_dir(dimension),
+                    self.coordinate(area["from"], key),
+                    self.coordinate(area.get("to", area["from"]), key),
+                )
+            )
+        return areas
+
+    def coordinate(self, value, key):
+        if (
+            not isinstance(value, list)
+            or len(value) != 2
+            or not all(isinstance(v, int) and not isinstance(v, bool) for v in value)
+        ):
+            raise ValueError(f'coordinates in "{key}" must be [x, z] integer pairs')
+        return tuple(value)
+
+    def dimension_dir(self, dimension):
+        dimension = DIMENSIONS.get(dimension, dimension).strip("/")
+        return dimension + "/" if dimension else ""
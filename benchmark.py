@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import gzip
+import time
+import uuid
+import zlib
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+import threading
+import psutil
+from backup_manager import Backup_Manager
+from region import CHUNK_COUNT, read_chunks, build_region
+
+DATA_VERSION = 4189
+BLOCKS = [
+    "minecraft:stone",
+    "minecraft:deepslate",
+    "minecraft:dirt",
+    "minecraft:grass_block",
+    "minecraft:gravel",
+    "minecraft:andesite",
+    "minecraft:coal_ore",
+    "minecraft:iron_ore",
+    "minecraft:water",
+    "minecraft:oak_log",
+]
+
+
+class Long_Array(bytes):
+    pass
+
+
+def nbt_payload(value):
+    if isinstance(value, Long_Array):
+        return 12, struct.pack(">i", len(value) // 8) + value
+    if isinstance(value, bytes):
+        return 7, struct.pack(">i", len(value)) + value
+    if isinstance(value, int):
+        return 3, struct.pack(">i", value)
+    if isinstance(value, float):
+        return 6, struct.pack(">d", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return 8, struct.pack(">H", len(data)) + data
+    if isinstance(value, list):
+        payloads = [nbt_payload(item) for item in value]
+        tag = payloads[0][0] if payloads else 0
+        return 9, bytes([tag]) + struct.pack(">i", len(payloads)) + b"".join(p for _, p in payloads)
+    if isinstance(value, dict):
+        data = bytearray()
+        for name, item in value.items():
+            tag, payload = nbt_payload(item)
+            name = name.encode("utf-8")
+            data += bytes([tag]) + struct.pack(">H", len(name)) + name + payload
+        return 10, bytes(data) + b"\0"
+    raise TypeError(f"Unsupported NBT value: {value!r}")
+
+
+def nbt_file(value):
+    tag, payload = nbt_payload(value)
+    return bytes([tag]) + struct.pack(">H", 0) + payload
+
+
+class Synthetic_World:
+    def __init__(self, root, seed=1):
+        self.root = root
+        self.rng = random.Random(seed)
+        self.tick = 0
+
+    def section_data(self):
+        data = bytearray(2048)
+        for _ in range(self.rng.randint(40, 400)):
+            start = self.rng.randrange(2048)
+            run = self.rng.randint(1, 16)
+            data[start : start + run] = bytes([self.rng.getrandbits(8)]) * len(data[start : start + run])
+        return Long_Array(data)
+
+    def chunk(self, x, z):
+        sections = []
+        for y in range(-4, 20):
+            if y > 6:
+                sections.append({"Y": y, "block_states": {"palette": [{"Name": "minecraft:air"}]}})
+                continue
+            palette = [{"Name": name} for name in self.rng.sample(BLOCKS, 8)]
+            palette += [{"Name": "minecraft:air"}] * 8
+            sections.append(
+                {
+                    "Y": y,
+                    "block_states": {"palette": palette, "data": self.section_data()},
+                    "biomes": {"palette": ["minecraft:plains"]},
+                    "BlockLight": bytes(2048),
+                    "SkyLight": bytes([0xFF]) * 2048 if y > 3 else bytes(2048),
+                }
+            )
+        value = {
+            "DataVersion": DATA_VERSION,
+            "xPos": x,
+            "zPos": z,
+            "yPos": -4,
+            "Status": "minecraft:full",
+            "LastUpdate": self.tick,
+            "InhabitedTime": self.rng.randrange(100000),
+            "sections": sections,
+            "block_entities": [],
+            "Heightmaps": {
+                "MOTION_BLOCKING": Long_Array(self.rng.randbytes(37 * 8)),
+                "WORLD_SURFACE": Long_Array(self.rng.randbytes(37 * 8)),
+            },
+        }
+        data = zlib.compress(nbt_file(value), 6)
+        payload = (len(data) + 1).to_bytes(4, "big") + b"\x02" + data
+        return payload, int(time.time()).to_bytes(4, "big")
+
+    def region_path(self, folder, region_x, region_z):
+        return os.path.join(self.root, folder, f"r.{region_x}.{region_z}.mca")
+
+    def region_coords(self, count):
+        side = max(1, int(count**0.5 + 0.999))
+        return [(i % side - side // 2, i // side - side // 2) for i in range(count)]
+
+    def generate(self, regions, chunks_per_region, players):
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        for region_x, region_z in self.region_coords(regions):
+            for folder, count in (("region", chunks_per_region), ("entities", chunks_per_region // 4)):
+                chunks = {}
+                for index in self.rng.sample(range(CHUNK_COUNT), min(count, CHUNK_COUNT)):
+                    chunks[index] = self.chunk(region_x * 32 + index % 32, region_z * 32 + index // 32)
+                self.write_region(self.region_path(folder, region_x, region_z), chunks)
+        for _ in range(players):
+            player = str(uuid.UUID(int=self.rng.getrandbits(128)))
+            self.write_player(player)
+            self.write_file(
+                os.path.join("stats", player + ".json"),
+                json.dumps({"stats": {"minecraft:custom": {"minecraft:play_time": 0}}}).encode(),
+            )
+        self.write_level()
+        self.write_file(os.path.join("data", "raids.dat"), gzip.compress(nbt_file({"data": {"Raids": []}}), mtime=0))
+        self.write_file("session.lock", b"\xe2\x98\x83")
+
+    def mutate(self, ratio, growth):
+        self.tick += 72000
+        regions = []
+        for folder in ("region", "entities"):
+            folder_path = os.path.join(self.root, folder)
+            regions += [os.path.join(folder_path, name) for name in sorted(os.listdir(folder_path))]
+        for path in regions:
+            region_x, region_z = map(int, os.path.basename(path).split(".")[1:3])
+            with open(path, "rb") as f:
+                chunks = read_chunks(f.read())
+            changed = False
+            for index in range(CHUNK_COUNT):
+                if self.rng.random() < (ratio if index in chunks else growth):
+                    chunks[index] = self.chunk(region_x * 32 + index % 32, region_z * 32 + index // 32)
+                    changed = True
+            if changed:
+                self.write_region(path, chunks)
+        players = sorted(os.listdir(os.path.join(self.root, "playerdata")))
+        for name in players:
+            if self.rng.random() < max(ratio, 0.5):
+                self.write_player(name[: -len(".dat")])
+        self.write_level()
+
+    def write_region(self, path, chunks):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(build_region(chunks))
+
+    def write_player(self, player):
+        inventory = [
+            {"Slot": slot, "id": self.rng.choice(BLOCKS), "count": self.rng.randint(1, 64)}
+            for slot in range(self.rng.randint(0, 36))
+        ]
+        value = {
+            "DataVersion": DATA_VERSION,
+            "Pos": [self.rng.uniform(-5000, 5000), 64.0, self.rng.uniform(-5000, 5000)],
+            "Health": 20,
+            "Inventory": inventory,
+        }
+        self.write_file(os.path.join("playerdata", player + ".dat"), gzip.compress(nbt_file(value), mtime=0))
+
+    def write_level(self):
+        value = {
+            "Data": {
+                "DataVersion": DATA_VERSION,
+                "LevelName": "benchmark",
+                "Time": self.tick,
+                "DayTime": self.tick % 24000,
+                "GameRules": {"doDaylightCycle": "true"},
+            }
+        }
+        self.write_file("level.dat", gzip.compress(nbt_file(value), mtime=0))
+
+    def write_file(self, path, data):
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(data)
+
+
+def dir_size(path):
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                size += os.lstat(os.path.join(dir_path, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def process_tree_rss(process):
+    rss = 0
+    try:
+        rss += process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+    except psutil.Error:
+        pass
+    return rss
+
+
+def measure(f, *args, interval=0.02):
+    process = psutil.Process()
+    peak = [process_tree_rss(process)]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], process_tree_rss(process))
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = f(*args)
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return result, elapsed, peak[0]
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def mb(value):
+    return "-" if value == None else f"{value / 1048576:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark world backup and restore.")
+    parser.add_argument("--work-dir", help="directory for the world and repository, temporary by default")
+    parser.add_argument("--config", help="config.json whose settings are used for the backup options")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a setting")
+    parser.add_argument("--regions", type=int, default=16)
+    parser.add_argument("--chunks", type=int, default=256, help="chunks per region file")
+    parser.add_argument("--players", type=int, default=16)
+    parser.add_argument("--cycles", type=int, default=5, help="backup cycles after the initial backup")
+    parser.add_argument("--mutation", type=float, default=0.05, help="fraction of chunks changed per cycle")
+    parser.add_argument("--growth", type=float, default=0.01, help="fraction of empty chunk slots filled per cycle")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-clean", action="store_true", help="don't benchmark the full clean")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="mcgui-benchmark-"))
+    settings = {}
+    if args.config != None:
+        with open(args.config, "r", encoding="utf-8") as configfile:
+            settings.update(json.load(configfile)["settings"])
+    for option in args.set:
+        key, value = option.split("=", 1)
+        settings[key] = parse_value(value)
+    settings["src_dir"] = os.path.join(work_dir, "world")
+    settings["git_dir"] = os.path.join(work_dir, "backup")
+    settings["snapshot_dir"] = os.path.join(work_dir, "world.snapshot")
+    for path in (settings["git_dir"], settings["snapshot_dir"]):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    world = Synthetic_World(settings["src_dir"], args.seed)
+    _, elapsed, _ = measure(world.generate, args.regions, args.chunks, args.players)
+    world_size = dir_size(settings["src_dir"])
+    print(f"Generated {mb(world_size)} MB world in {elapsed:.2f}s at {work_dir}")
+
+    backup_manager = Backup_Manager(settings)
+    if args.verbose:
+        backup_manager.sig_out.connect(print)
+    report = {"settings": settings, "world_size": world_size, "cycles": []}
+    print(f"{'cycle':>5} {'backup s':>9} {'changed':>8} {'written MB':>11} {'repo MB':>9} {'growth MB':>10} {'peak RSS MB':>12}")
+    names = []
+    try:
+        for cycle in range(args.cycles + 1):
+            if cycle > 0:
+                world.mutate(args.mutation, args.growth)
+            name = f"{backup_manager.backup_prefix}benchmark{cycle:04d}"
+            names.append(name)
+            before = dir_size(settings["git_dir"])
+            result, elapsed, peak = measure(backup_manager.new_commit, name)
+            result = result or {}
+            after = dir_size(settings["git_dir"])
+            row = {
+                "cycle": cycle,
+                "backup_time": elapsed,
+                "changed": result.get("changed"),
+                "bytes_written": result.get("bytes"),
+                "repo_size": after,
+                "repo_growth": after - before,
+                "peak_rss": peak,
+            }
+            report["cycles"].append(row)
+            print(
+                f"{cycle:>5} {elapsed:>9.2f} {str(row['changed'] if row['changed'] != None else '-'):>8} "
+                f"{mb(row['bytes_written']):>11} {mb(after):>9} {mb(row['repo_growth']):>10} {mb(peak):>12}"
+            )
+
+        result, elapsed, peak = measure(backup_manager.new_branch, names[0])
+        result = result or {}
+        report["restore"] = {
+            "restore_time": elapsed,
+            "bytes_written": result.get("written"),
+            "peak_rss": peak,
+        }
+        print(f"Restore to {names[0]}: {elapsed:.2f}s, {mb(result.get('written'))} MB written, peak RSS {mb(peak)} MB")
+
+        if not args.skip_clean:
+            before = dir_size(settings["git_dir"])
+            _, elapsed, peak = measure(backup_manager.clean)
+            after = dir_size(settings["git_dir"])
+            report["clean"] = {"clean_time": elapsed, "repo_size": after, "repo_growth": after - before, "peak_rss": peak}
+            print(f"Clean: {elapsed:.2f}s, repo {mb(before)} MB -> {mb(after)} MB, peak RSS {mb(peak)} MB")
+    finally:
+        backup_manager.store.close()
+        if not args.keep and args.work_dir == None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json != None:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import json
+import re
+import time
+from collections import deque
+from PyQt5.QtCore import QObject, QTimer
+
+MESSAGE_PATTERN = re.compile(r"^\[[^\]]*\] \[[^\]]*/([A-Z]+)\]: ")
+DEFAULT_COLORS = {"INFO": "gray", "WARN": "gold", "ERROR": "red"}
+
+
+class Ingame_Broadcaster(QObject):
+    def __init__(self, server, settings):
+        super().__init__()
+        self.server = server
+        self.levels = set(settings.get("ingame_output_levels", ["INFO", "WARN", "ERROR"]))
+        self.colors = settings.get("ingame_output_colors", DEFAULT_COLORS)
+        self.target = settings.get("ingame_output_target", "@a")
+        self.window = settings.get("ingame_output_window", 500)
+        self.rate = settings.get("ingame_output_rate", 2)
+        self.max_lines = settings.get("ingame_output_max_lines", 10)
+        self.max_pending = settings.get("ingame_output_max_pending", 100)
+
+        self.pending = deque()
+        self.dropped = 0
+        self.sent_times = deque()
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+
+        self.flush_timer.timeout.connect(self.flush)
+
+    def broadcast(self, output):
+        match = MESSAGE_PATTERN.match(output)
+        level = match.group(1) if match else "INFO"
+        if level not in self.levels:
+            return
+        lines = output.splitlines()
+        if len(lines) > self.max_lines:
+            hidden = len(lines) - self.max_lines + 1
+            lines = lines[: self.max_lines - 1] + [f"... and {hidden} more lines"]
+        color = self.colors.get(level, "white")
+        for line in lines:
+            self.pending.append((line, color))
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft()
+            self.dropped += 1
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(self.window)
+
+    def flush(self):
+        if not self.server.is_running:
+            self.pending.clear()
+            self.dropped = 0
+            return
+        now = time.monotonic()
+        while self.sent_times and now - self.sent_times[0] >= 1:
+            self.sent_times.popleft()
+        if self.rate <= 0:
+            while self.pending:
+                self.server.server_exec_silent(self.take_payload())
+            return
+        while self.pending and len(self.sent_times) < self.rate:
+            self.server.server_exec_silent(self.take_payload())
+            self.sent_times.append(now)
+        if self.pending and self.sent_times:
+            wait = 1 - (now - self.sent_times[0])
+            self.flush_timer.start(max(int(wait * 1000), self.window))
+
+    def take_payload(self):
+        components = [""]
+        if self.dropped:
+            components.append(
+                {"text": f"... {self.dropped} lines dropped\n", "color": "dark_gray"}
+            )
+            self.dropped = 0
+        for _ in range(min(self.max_lines, len(self.pending))):
+            line, color = self.pending.popleft()
+            components.append({"text": line + "\n", "color": color})
+        components[-1]["text"] = components[-1]["text"].rstrip("\n")
+        return f"tellraw {self.target} {json.dumps(components, ensure_ascii=False)}"
@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import subprocess
+
+from region import CHUNKS_SUFFIX
+from utils import CREATE_NO_WINDOW
+
+CATALOG_FILE = "backup_catalog.sqlite"
+
+
+class Backup_Catalog:
+    def __init__(self, git_dir, backup_prefix, tagged_backup_prefix):
+        self.git_dir = git_dir
+        self.backup_prefix = backup_prefix
+        self.tagged_backup_prefix = tagged_backup_prefix
+        self.path = os.path.join(self.git_dir, CATALOG_FILE)
+
+    def connect(self):
+        os.makedirs(self.git_dir, exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS backups ("
+            "hash TEXT PRIMARY KEY, name TEXT NOT NULL, timestamp INTEGER NOT NULL, "
+            "tag TEXT, size INTEGER, size_delta INTEGER, file_count INTEGER)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS backups_name ON backups (name)")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS backups_timestamp ON backups (timestamp)"
+        )
+        return connection
+
+    def tag_of(self, name):
+        if name.startswith(self.tagged_backup_prefix):
+            return name[len(self.tagged_backup_prefix) :]
+        return None
+
+    def is_backup(self, name):
+        return name.startswith(self.backup_prefix) or name.startswith(
+            self.tagged_backup_prefix
+        )
+
+    def add(self, commit_hash, name, timestamp, size, file_count):
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT size FROM backups ORDER BY timestamp DESC, rowid DESC LIMIT 1"
+            ).fetchone()
+            size_delta = None if row is None or row[0] is None else size - row[0]
+            connection.execute(
+                "INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    commit_hash,
+                    name,
+                    timestamp,
+                    self.tag_of(name),
+                    size,
+                    size_delta,
+                    file_count,
+                ),
+            )
+        connection.close()
+
+    def remove(self, commit_hashes):
+        with self.connect() as connection:
+            connection.executemany(
+                "DELETE FROM backups WHERE hash = ?", [(h,) for h in commit_hashes]
+            )
+        connection.close()
+
+    def apply_rewrite(self, removed, rewritten):
+        with self.connect() as connection:
+            connection.executemany(
+                "DELETE FROM backups WHERE hash = ?", [(h,) for h in removed]
+            )
+            connection.executemany(
+                "UPDATE backups SET hash = ? WHERE hash = ?",
+                [(new, old) for old, new in rewritten.items()],
+            )
+            rows = connection.execute(
+                "SELECT hash, size FROM backups ORDER BY timestamp, rowid"
+            ).fetchall()
+            updates = []
+            previous_size = None
+            for commit_hash, size in rows:
+                size_delta = None if previous_size is None or size is None else size - previous_size
+                previous_size = size
+                updates.append((size_delta, commit_hash))
+            connection.executemany(
+                "UPDATE backups SET size_delta = ? WHERE hash = ?", updates
+            )
+        connection.close()
+
+    def is_empty(self):
+        connection = self.connect()
+        row = connection.execute("SELECT 1 FROM backups LIMIT 1").fetchone()
+        connection.close()
+        return row is None
+
+    def list(self, prefix=None, since=None, until=None, limit=None, offset=0):
+        query = "SELECT name, hash, timestamp, tag, size, size_delta, file_count FROM backups"
+        conditions = []
+        args = []
+        if prefix is not None:
+            conditions.append("name >= ? AND name < ?")
+            args += [prefix, prefix + "\U0010ffff"]
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            args.append(since)
+        if until is not None:
+            conditions.append("timestamp <= ?")
+            args.append(until)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp DESC, rowid DESC LIMIT ? OFFSET ?"
+        args += [-1 if limit is None else limit, offset]
+        connection = self.connect()
+        rows = connection.execute(query, args).fetchall()
+        connection.close()
+        return [
+            dict(
+                zip(
+                    ("name", "hash", "timestamp", "tag", "size", "size_delta", "file_count"),
+                    row,
+                )
+            )
+            for row in rows
+        ]
+
+    def find(self, name):
+        connection = self.connect()
+        row = connection.execute(
+            "SELECT hash FROM backups WHERE name = ? ORDER BY timestamp DESC, rowid DESC LIMIT 1",
+            (name,),
+        ).fetchone()
+        connection.close()
+        return None if row is None else row[0]
+
+    def tree_stats(self, commit_hash):
+        output = subprocess.check_output(
+            ["git", "--git-dir", self.git_dir, "ls-tree", "-r", "-l", "-z", "--full-tree", commit_hash],
+            creationflags=CREATE_NO_WINDOW,
+        )
+        files = set()
+        size = 0
+        for record in output.split(b"\0"):
+            if not record:
+                continue
+            info, path = record.split(b"\t", 1)
+            fields = info.split()
+            if fields[1] != b"blob":
+                continue
+            path = os.fsdecode(path)
+            marker = path.rfind(CHUNKS_SUFFIX + "/")
+            files.add(path if marker == -1 else path[:marker])
+            size += int(fields[3])
+        return size, len(files)
+
+    def rebuild(self):
+        try:
+            output = subprocess.check_output(
+                ["git", "--git-dir", self.git_dir, "log", "--all", "--reverse", "--pretty=format:%H%x00%ct%x00%s"],
+                stderr=subprocess.DEVNULL,
+                creationflags=CREATE_NO_WINDOW,
+            )
+        except subprocess.CalledProcessError:
+            output = b""
+        rows = []
+        previous_size = None
+        for line in output.decode("utf-8", errors="replace").split("\n"):
+            if not line:
+                continue
+            commit_hash, timestamp, name = line.split("\0", 2)
+            if not self.is_backup(name):
+                continue
+            size, file_count = self.tree_stats(commit_hash)
+            size_delta = None if previous_size is None else size - previous_size
+            previous_size = size
+            rows.append(
+                (commit_hash, name, int(timestamp), self.tag_of(name), size, size_delta, file_count)
+            )
+        with self.connect() as connection:
+            connection.execute("DELETE FROM backups")
+            connection.executemany(
+                "INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        connection.close()
+        return len(rows)
@@ -0,0 +1,102 @@
+import os
+import threading
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+
+class World_Change_Tracker:
+    def __init__(self, src_dir, store, watch=False):
+        self.src_dir = src_dir
+        self.store = store
+        self.watch = watch
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.observer = None
+        self.files = None
+        self.dirty = set()
+        self.primed = False
+
+    def is_watching(self):
+        return self.observer != None
+
+    def start(self):
+        if not self.watch or Observer == None or self.observer != None:
+            return False
+        observer = Observer()
+        try:
+            observer.schedule(self, self.src_dir, recursive=True)
+            observer.start()
+        except OSError:
+            return False
+        self.observer = observer
+        return True
+
+    def stop(self):
+        observer = self.observer
+        self.observer = None
+        with self.lock:
+            self.primed = False
+            self.files = None
+            self.dirty = set()
+        if observer != None:
+            observer.stop()
+            observer.join(5)
+
+    def reset(self):
+        self.stop()
+        self.start()
+
+    def dispatch(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        with self.lock:
+            if not self.primed:
+                return
+            if event.is_directory:
+                if event.event_type != "modified":
+                    self.primed = False
+                return
+            for path in (event.src_path, getattr(event, "dest_path", "")):
+                if not path:
+                    continue
+                path = os.path.relpath(os.fsdecode(path), self.src_dir).replace(os.sep, "/")
+                if not path.startswith("../") and not self.store.is_ignored_path(path):
+                    self.dirty.add(path)
+
+    def current_files(self):
+        with self.lock:
+            if self.observer != None and self.primed:
+                dirty, self.dirty = self.dirty, set()
+                files = self.files
+            else:
+                dirty = None
+                self.dirty = set()
+                self.primed = self.observer != None
+        if dirty == None:
+            files = self.store.scan(self.src_dir)
+        else:
+            for path in dirty:
+                entry = self.store.stat_entry(os.path.join(self.src_dir, *path.split("/")))
+                if entry == None:
+                    files.pop(path, None)
+                else:
+                    files[path] = entry
+        with self.lock:
+            if self.primed:
+                self.files = files
+        return dict(files)
+
+    def changes(self):
+        with self.scan_lock:
+            files = self.current_files()
+        baseline = self.store.load_manifest(self.store.resolve("HEAD"))
+        changed = [
+            path
+            for path, entry in files.items()
+            if path not in baseline or baseline[path][:2] != list(entry[:2])
+        ]
+        changed += [path for path in baseline if path not in files]
+        return files, sorted(changed)
@@ -0,0 +1,114 @@
+import re
+from collections import OrderedDict
+from PyQt5.QtWidgets import QPlainTextEdit
+from PyQt5.QtCore import QTimer
+from PyQt5 import QtGui
+
+TIMESTAMP_PATTERN = re.compile(r"^\[[0-9:.\- ]+\] ?")
+
+
+class Console_Formatter:
+    def __init__(self, colormap, exclude, cache_size=512):
+        self.cache_size = cache_size
+        self.compile(colormap, exclude)
+
+    def compile(self, colormap, exclude):
+        self.keys = [key for key in colormap if key != "__fallback__"]
+        self.key_index = {}
+        for index, key in enumerate(self.keys):
+            self.key_index.setdefault(key, index)
+        self.formats = [self.make_format(colormap[key]) for key in self.keys]
+        self.fallback_format = self.make_format(colormap.get("__fallback__", "black"))
+        self.color_matcher = None
+        self.exclude_matcher = None
+        if self.keys:
+            self.color_matcher = re.compile("|".join(map(re.escape, self.keys)))
+        if exclude:
+            self.exclude_matcher = re.compile("|".join(map(re.escape, exclude)))
+        self.cache = OrderedDict()
+
+    def make_format(self, color):
+        format = QtGui.QTextCharFormat()
+        format.setForeground(QtGui.QColor(color))
+        return format
+
+    def classify(self, line):
+        key = TIMESTAMP_PATTERN.sub("", line, count=1)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            return cached[0]
+        format = self.match(key)
+        self.cache[key] = (format,)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return format
+
+    def match(self, line):
+        if self.exclude_matcher is not None and self.exclude_matcher.search(line):
+            return None
+        if self.color_matcher is None:
+            return self.fallback_format
+        best = None
+        for match in self.color_matcher.finditer(line):
+            index = self.key_index[match.group()]
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        if best is None:
+            return self.fallback_format
+        # finditer skips keys overlapping an earlier match, so recheck the
+        # few keys that would take precedence over the one we found.
+        for index in range(best):
+            if self.keys[index] in line:
+                best = index
+                break
+        return self.formats[best]
+
+
+class Console(QPlainTextEdit):
+    def __init__(self, parent, scrollback=5000, flush_interval=16):
+        super().__init__(parent)
+        self.scrollback = scrollback
+        self.pending = []
+        self.flush_timer = QTimer(self)
+
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setMaximumBlockCount(self.scrollback)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval)
+
+        self.flush_timer.timeout.connect(self.flush)
+
+    def write_lines(self, lines):
+        self.pending.extend(lines)
+        if self.scrollback > 0 and len(self.pending) > self.scrollback:
+            del self.pending[: -self.scrollback]
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+
+        scrollbar = self.verticalScrollBar()
+        follow = scrollbar.value() >= scrollbar.maximum()
+
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.beginEditBlock()
+        for line, format in pending:
+            cursor.insertText(line + "\n", format)
+        cursor.endEditBlock()
+
+        if follow:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def clear(self):
+        self.pending.clear()
+        self.flush_timer.stop()
+        super().clear()
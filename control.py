@@ -0,0 +1,494 @@
+import json
+import math
+import time
+import datetime
+from collections import deque
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+from utils import is_positive_int
+
+ROLE = "Control"
+DEFAULT_SOCKET_NAME = "minecraft-server-gui"
+PROTOCOL_VERSION = 1
+MAX_MESSAGE_SIZE = 1 << 20
+MAX_PENDING_WRITE = 8 << 20
+RECONNECT_INTERVAL = 2
+PROBE_TIMEOUT = 1
+
+
+def encode_message(message):
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def is_listening(name, timeout=PROBE_TIMEOUT):
+    probe = QLocalSocket()
+    probe.connectToServer(name)
+    if not probe.waitForConnected(int(timeout * 1000)):
+        return False
+    probe.abort()
+    return True
+
+
+def task_info(task):
+    return {
+        "id": task.id,
+        "name": task.name,
+        "kind": task.kind,
+        "state": task.state,
+        "error": None if task.error == None else str(task.error),
+    }
+
+
+def server_info(server):
+    return {
+        "is_running": server.is_running,
+        "start_time": None if server.start_time == None else server.start_time.timestamp(),
+        "player_count": server.player_count,
+        "cpu_usage": server.cpu_usage,
+        "memory_usage": server.memory_usage,
+        "resource_usage": server.resource_usage,
+        "mspt": server.mspt,
+    }
+
+
+class Message_Stream(QObject):
+    sig_message = pyqtSignal(object)
+
+    def __init__(self, socket):
+        super().__init__()
+        self.socket = socket
+        self.buffer = b""
+        self.attached = False
+        self.socket.readyRead.connect(self.when_ready_read)
+
+    def send(self, message):
+        if self.socket.state() != QLocalSocket.ConnectedState:
+            return
+        if self.socket.bytesToWrite() > MAX_PENDING_WRITE:
+            self.socket.abort()
+            return
+        self.socket.write(encode_message(message))
+
+    def when_ready_read(self):
+        self.buffer += bytes(self.socket.readAll())
+        while True:
+            line, separator, rest = self.buffer.partition(b"\n")
+            if not separator:
+                break
+            self.buffer = rest
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, dict):
+                self.sig_message.emit(message)
+        if len(self.buffer) > MAX_MESSAGE_SIZE:
+            self.socket.abort()
+
+
+class Control_Server(QObject):
+    def __init__(self, core, name=DEFAULT_SOCKET_NAME, history=1000):
+        super().__init__()
+        self.core = core
+        self.name = name
+        self.history = deque(maxlen=history)
+        self.session = int(time.time() * 1000)
+        self.sequence = 0
+        self.streams = []
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.UserAccessOption)
+        self.server.newConnection.connect(self.when_new_connection)
+
+        server = core.server
+        scheduler = core.scheduler
+        core.sig_out.connect(self.when_core_out)
+        server.sig_out.connect(self.when_server_out)
+        core.backup_manager.sig_out.connect(self.when_backup_out)
+        server.sig_server_lines.connect(self.when_server_lines)
+        server.sig_info_updated.connect(self.when_server_info_updated)
+        scheduler.sig_task_started.connect(self.when_task_started)
+        scheduler.sig_task_progress.connect(self.when_task_progress)
+        scheduler.sig_task_done.connect(self.when_task_done)
+
+    def start(self):
+        if is_listening(self.name):
+            raise OSError("another instance is already listening on it")
+        QLocalServer.removeServer(self.name)
+        if not self.server.listen(self.name):
+            raise OSError(self.server.errorString())
+
+    def stop(self):
+        self.server.close()
+        for stream in list(self.streams):
+            stream.socket.flush()
+            stream.socket.disconnectFromServer()
+        self.streams = []
+
+    def when_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            stream = Message_Stream(socket)
+            stream.sig_message.connect(lambda message, stream=stream: self.handle(stream, message))
+            socket.disconnected.connect(lambda stream=stream: self.when_disconnected(stream))
+            socket.disconnected.connect(socket.deleteLater)
+            self.streams.append(stream)
+
+    def when_disconnected(self, stream):
+        if stream in self.streams:
+            self.streams.remove(stream)
+
+    def publish(self, message):
+        for stream in list(self.streams):
+            if stream.attached:
+                stream.send(message)
+
+    def record(self, source, lines):
+        first = self.sequence + 1
+        for line in lines:
+            self.sequence += 1
+            self.history.append((self.sequence, source, line))
+        self.publish({"event": "out", "seq": first, "source": source, "lines": lines})
+
+    def when_core_out(self, line):
+        self.record("core", [line])
+
+    def when_server_out(self, line):
+        self.record("server", [line])
+
+    def when_backup_out(self, line):
+        self.record("backup", [line])
+
+    def when_server_lines(self, lines):
+        self.record("server_lines", lines)
+
+    def when_server_info_updated(self):
+        self.publish({"event": "info", "info": server_info(self.core.server)})
+
+    def when_task_started(self, task):
+        self.publish({"event": "task_started", "task": task_info(task)})
+
+    def when_task_progress(self, task, step, total, name, percent):
+        self.publish(
+            {
+                "event": "task_progress",
+                "task": task_info(task),
+                "step": step,
+                "total": total,
+                "name": name,
+                "percent": percent,
+            }
+        )
+
+    def when_task_done(self, task):
+        self.publish({"event": "task_done", "task": task_info(task)})
+
+    def reply(self, stream, message, result=None, error=None):
+        if "id" not in message or stream not in self.streams:
+            return
+        if error != None:
+            stream.send({"id": message["id"], "error": error})
+        else:
+            stream.send({"id": message["id"], "result": result})
+
+    def handle(self, stream, message):
+        request = message.get("request")
+        if request == "attach":
+            since = message.get("since", 0) if message.get("session") == self.session else 0
+            if not is_number(since):
+                self.reply(stream, message, error='"since" must be a number')
+                return
+            history = [list(entry) for entry in self.history if entry[0] > since]
+            stream.attached = True
+            self.reply(
+                stream,
+                message,
+                {
+                    "version": PROTOCOL_VERSION,
+                    "session": self.session,
+                    "info": server_info(self.core.server),
+                    "tasks": [task_info(task) for task in self.core.scheduler.tasks()],
+                    "history": history,
+                },
+            )
+        elif request == "detach":
+            stream.attached = False
+            self.reply(stream, message, True)
+        elif request == "status":
+            self.reply(
+                stream,
+                message,
+                {
+                    "info": server_info(self.core.server),
+                    "tasks": [task_info(task) for task in self.core.scheduler.tasks()],
+                },
+            )
+        elif request == "exec":
+            command = message.get("command")
+            if not isinstance(command, str) or not command:
+                self.reply(stream, message, error='"command" is missing')
+                return
+            if self.core.log_archive != None:
+                self.core.log_archive.append(self.core.format_line("User", "INFO", command))
+            self.core.exec(command)
+            self.reply(stream, message, True)
+        elif request == "start_server":
+            if not self.core.server.is_running:
+                self.core.start_server()
+            self.reply(stream, message, True)
+        elif request == "stop_server":
+            if self.core.server.is_running:
+                self.core.stop_server()
+            self.reply(stream, message, True)
+        elif request == "search":
+            query = message.get("query", "")
+            since = message.get("since")
+            until = message.get("until")
+            limit = message.get("limit", 200)
+            if not isinstance(query, str):
+                self.reply(stream, message, error='"query" must be a string')
+                return
+            if any(value != None and not is_number(value) for value in (since, until)):
+                self.reply(stream, message, error='"since" and "until" must be numbers')
+                return
+            if not is_positive_int(limit):
+                self.reply(stream, message, error='"limit" must be a positive integer')
+                return
+            self.core.request_log_search(
+                query,
+                since,
+                until,
+                limit,
+                lambda results: self.reply(stream, message, results),
+            )
+        elif request == "shutdown":
+            self.reply(stream, message, True)
+            self.core.sig_shutdown_requested.emit()
+        else:
+            self.reply(stream, message, error=f'Unknown request "{request}"')
+
+
+class Remote_Task:
+    def __init__(self, info):
+        self.id = info["id"]
+        self.name = info["name"]
+        self.kind = info["kind"]
+        self.state = info["state"]
+        self.error = info["error"]
+
+
+class Remote_Server(QObject):
+    sig_out = pyqtSignal(str)
+    sig_server_lines = pyqtSignal(list)
+    sig_info_updated = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.is_running = False
+        self.start_time = None
+        self.player_count = 0
+        self.cpu_usage = None
+        self.memory_usage = None
+        self.resource_usage = None
+        self.mspt = None
+
+    def update(self, info):
+        self.is_running = info["is_running"]
+        self.start_time = None
+        if info["start_time"] != None:
+            self.start_time = datetime.datetime.fromtimestamp(info["start_time"])
+        self.player_count = info["player_count"]
+        self.cpu_usage = info["cpu_usage"]
+        self.memory_usage = info["memory_usage"]
+        self.resource_usage = info["resource_usage"]
+        self.mspt = info["mspt"]
+        self.sig_info_updated.emit()
+
+
+class Remote_Scheduler(QObject):
+    sig_task_started = pyqtSignal(object)
+    sig_task_progress = pyqtSignal(object, int, int, str, int)
+    sig_task_done = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.running = {}
+
+    def is_busy(self):
+        return len(self.running) > 0
+
+    def when_task_started(self, info):
+        task = Remote_Task(info)
+        self.running[task.id] = task
+        self.sig_task_started.emit(task)
+
+    def when_task_progress(self, info, step, total, name, percent):
+        task = Remote_Task(info)
+        self.running[task.id] = task
+        self.sig_task_progress.emit(task, step, total, name, percent)
+
+    def when_task_done(self, info):
+        task = Remote_Task(info)
+        self.running.pop(task.id, None)
+        self.sig_task_done.emit(task)
+
+    def reset(self, tasks):
+        for task in list(self.running.values()):
+            self.running.pop(task.id)
+            self.sig_task_done.emit(task)
+        for info in tasks:
+            if info["state"] in ("preparing", "running"):
+                self.when_task_started(info)
+
+
+class Remote_Backup_Manager(QObject):
+    sig_out = pyqtSignal(str)
+
+
+class Control_Client(QObject):
+    sig_out = pyqtSignal(str)
+
+    def __init__(self, name=DEFAULT_SOCKET_NAME, timestamp_format="%H:%M:%S"):
+        super().__init__()
+        self.name = name
+        self.timestamp_format = timestamp_format
+        self.server = Remote_Server()
+        self.scheduler = Remote_Scheduler()
+        self.backup_manager = Remote_Backup_Manager()
+        self.log_archive = None
+        self.session = None
+        self.last_sequence = 0
+        self.next_id = 1
+        self.callbacks = {}
+        self.quitting = False
+        self.socket = QLocalSocket(self)
+        self.stream = Message_Stream(self.socket)
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+
+        self.stream.sig_message.connect(self.when_message)
+        self.socket.connected.connect(self.when_connected)
+        self.socket.disconnected.connect(self.when_disconnected)
+        self.socket.errorOccurred.connect(self.when_error)
+        self.reconnect_timer.timeout.connect(self.connect_to_daemon)
+
+    def out(self, role, flag, line):
+        current_time = datetime.datetime.now().strftime(self.timestamp_format)
+        self.sig_out.emit(f"[{current_time}] [{role}/{flag}]: {line}")
+
+    def connect_to_daemon(self, timeout=None):
+        self.socket.abort()
+        self.socket.connectToServer(self.name)
+        if timeout != None:
+            return self.socket.waitForConnected(int(timeout * 1000))
+        return True
+
+    def request(self, request, callback=None, **params):
+        message = {"id": self.next_id, "request": request, **params}
+        if callback != None:
+            self.callbacks[self.next_id] = callback
+        self.next_id += 1
+        self.stream.send(message)
+
+    def when_connected(self):
+        self.request("attach", self.when_attached, session=self.session, since=self.last_sequence)
+
+    def when_attached(self, result):
+        if result["version"] != PROTOCOL_VERSION:
+            self.out(ROLE, "WARN", f"Server daemon speaks protocol version {result['version']}")
+        if result["session"] != self.session:
+            self.session = result["session"]
+            self.last_sequence = 0
+        batch = []
+        for sequence, source, line in result["history"]:
+            if batch and (source != batch[0][1] or sequence != batch[-1][0] + 1):
+                self.when_output(batch[0][0], batch[0][1], [entry[2] for entry in batch])
+                batch = []
+            batch.append((sequence, source, line))
+        if batch:
+            self.when_output(batch[0][0], batch[0][1], [entry[2] for entry in batch])
+        self.out(ROLE, "INFO", f'Attached to "{self.name}"')
+        self.server.update(result["info"])
+        self.scheduler.reset(result["tasks"])
+
+    def when_disconnected(self):
+        self.callbacks.clear()
+        if not self.quitting:
+            self.out(ROLE, "WARN", f'Lost connection to "{self.name}", reconnecting...')
+            self.reconnect_timer.start(RECONNECT_INTERVAL * 1000)
+
+    def when_error(self, error):
+        if error != QLocalSocket.PeerClosedError and not self.quitting:
+            if not self.reconnect_timer.isActive():
+                self.reconnect_timer.start(RECONNECT_INTERVAL * 1000)
+
+    def when_message(self, message):
+        if "id" in message:
+            callback = self.callbacks.pop(message["id"], None)
+            if "error" in message:
+                self.out(ROLE, "WARN", message["error"])
+            elif callback != None:
+                callback(message["result"])
+            return
+        event = message.get("event")
+        if event == "out":
+            self.when_output(message["seq"], message["source"], message["lines"])
+        elif event == "info":
+            self.server.update(message["info"])
+        elif event == "task_started":
+            self.scheduler.when_task_started(message["task"])
+        elif event == "task_progress":
+            self.scheduler.when_task_progress(
+                message["task"], message["step"], message["total"], message["name"], message["percent"]
+            )
+        elif event == "task_done":
+            self.scheduler.when_task_done(message["task"])
+
+    def when_output(self, sequence, source, lines):
+        skip = max(self.last_sequence - sequence + 1, 0)
+        lines = lines[skip:]
+        if not lines:
+            return
+        self.last_sequence = sequence + skip + len(lines) - 1
+        if source == "server_lines":
+            self.server.sig_server_lines.emit(lines)
+            return
+        signal = {
+            "core": self.sig_out,
+            "server": self.server.sig_out,
+            "backup": self.backup_manager.sig_out,
+        }.get(source, self.sig_out)
+        for line in lines:
+            signal.emit(line)
+
+    def exec(self, command):
+        self.request("exec", command=command)
+
+    def start_server(self):
+        self.request("start_server")
+
+    def stop_server(self):
+        self.request("stop_server")
+
+    def shutdown(self):
+        self.request("shutdown")
+
+    def request_log_search(self, query, since, until, limit, callback):
+        self.request(
+            "search",
+            lambda results: callback([tuple(result) for result in results]),
+            query=query,
+            since=since,
+            until=until,
+            limit=limit,
+        )
+
+    def when_about_to_quit(self):
+        self.quitting = True
+        self.reconnect_timer.stop()
+        if self.socket.state() == QLocalSocket.ConnectedState:
+            self.socket.flush()
+            self.socket.disconnectFromServer()
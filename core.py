@@ -1,47 +1,165 @@
 import datetime
 import json
+import os
 import re
+import sqlite3
+import threading
+import time
 from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 from server_manager import Server_Manager
 from backup_manager import Backup_Manager
-from utils import Listener_for_Specific_Output, Wait_for_a_Signal
+from load_monitor import Load_Monitor
+from scheduler import (
+    Task,
+    PRIORITY_RESTORE,
+    PRIORITY_TAGGED_BACKUP,
+    PRIORITY_AUTO_BACKUP,
+    PRIORITY_MAINTENANCE,
+)
+from metrics import Metrics_Registry, Metrics_Collector, Metrics_Server
+from log_archive import Log_Archive
+from broadcaster import Ingame_Broadcaster
+from control import Control_Server, DEFAULT_SOCKET_NAME
+from utils import Listener_for_Specific_Output, is_positive_int
 
 ROLE = "Core"
+PLAYER_CMD_PATTERN = r"^.+? <(.*?)> \$([a-zA-Z0-9_]+) (.+)$"
 
 
 class Core(QObject):
     sig_out = pyqtSignal(str)
+    sig_shutdown_requested = pyqtSignal()
+    sig_log_search_done = pyqtSignal(object, list)
 
-    def __init__(self, settings):
+    def __init__(self, settings, name=None, limiter=None, executor=None):
         super().__init__()
 
-        self.is_backing_up = False
+        self.name = name
+        self.saving_disabled = False
+        self.restart_server_later = False
 
         self.backup_interval = settings.get("backup_interval", 1800)
         self.info_update_interval = settings.get("info_update_interval", 1)
         self.timestamp_format = settings.get("timestamp_format", "%H:%M:%S")
         self.auto_backup = settings.get("auto_backup", True)
+        self.skip_unchanged_backups = settings.get("skip_unchanged_backups", True)
         self.backup_when_players_online = settings.get("backup_when_players_online", True)
         self.start_server_at_startup = settings.get("start_server_at_startup", True)
+        self.quit_backup_timeout = settings.get("quit_backup_timeout", 600)
+        self.staged_restore = settings.get("staged_restore", True)
+        self.maintenance_interval = settings.get("maintenance_interval", 21600)
+        self.maintenance_when_players_online = settings.get(
+            "maintenance_when_players_online", False
+        )
+        self.backup_max_deferral = settings.get("backup_max_deferral", 1800)
+        self.backup_defer_check_interval = settings.get("backup_defer_check_interval", 60)
+        self.backup_due_time = None
+        self.checking_load = False
+        self.metrics_address = settings.get("metrics_address")
+        self.metrics_server = None
+        self.control_socket = settings.get("control_socket")
+        self.control_history = settings.get("control_history", 1000)
+        self.control_server = None
 
         self.server = Server_Manager(settings)
-        self.backup_manager = Backup_Manager(settings)
+        self.backup_manager = Backup_Manager(settings, limiter, executor)
+        self.scheduler = self.backup_manager.scheduler
+        self.load_monitor = Load_Monitor(self.server, settings)
+        self.ingame_broadcaster = Ingame_Broadcaster(self.server, settings)
+        self.log_archive = None
+        if settings.get("log_archive", True):
+            self.log_archive = Log_Archive(
+                os.path.abspath(
+                    settings.get(
+                        "log_archive_dir", os.path.join(settings.get("work_dir", "."), "log_archive")
+                    )
+                ),
+                segment_size=settings.get("log_archive_segment_size", 16 << 20),
+                max_age=settings.get("log_archive_max_age"),
+                block_lines=settings.get("log_archive_block_lines", 1000),
+                flush_interval=settings.get("log_archive_flush_interval", 5),
+            )
         self.update_info_timer = QTimer()
         self.backup_timer = QTimer()
+        self.maintenance_timer = QTimer()
+        self.backup_defer_timer = QTimer()
+        self.backup_defer_timer.setSingleShot(True)
         self.player_cmd_listener = Listener_for_Specific_Output(
-            self.server.sig_server_out, lambda x: "$" in x and "<" in x and ">" in x
+            self.server.output_dispatcher, PLAYER_CMD_PATTERN, regex=True
         )
 
         self.update_info_timer.timeout.connect(self.server.update_server_info)
+        self.update_info_timer.timeout.connect(self.load_monitor.sample)
         self.backup_timer.timeout.connect(self.when_time_to_backup)
-        self.backup_manager.sig_task_done.connect(self.when_backup_done)
+        self.maintenance_timer.timeout.connect(self.when_time_to_maintain)
+        self.backup_defer_timer.timeout.connect(self.check_load_then_backup)
+        self.scheduler.sig_task_started.connect(self.when_task_started)
+        self.scheduler.sig_task_done.connect(self.when_task_done)
+        self.backup_manager.sig_snapshot_done.connect(self.when_snapshot_done)
         self.player_cmd_listener.sig.connect(self.when_detected_player_cmd)
+        self.sig_log_search_done.connect(self.when_log_search_done)
+        self.sig_out.connect(self.ingame_broadcaster.broadcast)
+        self.server.sig_out.connect(self.ingame_broadcaster.broadcast)
+        self.backup_manager.sig_out.connect(self.ingame_broadcaster.broadcast)
+        if self.log_archive != None:
+            self.sig_out.connect(self.log_archive.append)
+            self.server.sig_out.connect(self.log_archive.append)
+            self.backup_manager.sig_out.connect(self.log_archive.append)
+            self.server.sig_server_lines.connect(self.log_archive.append_lines)
+            self.log_archive.sig_error.connect(lambda line: self.out(ROLE, "WARN", line))
+        if self.maintenance_interval > 0:
+            self.maintenance_timer.start(self.maintenance_interval * 1000)
+        if self.metrics_address != None:
+            self.start_metrics_server()
+        if self.control_socket != None:
+            self.start_control_server()
         if self.start_server_at_startup:
 
             self.start_server()
 
+    def request_log_search(self, query, since, until, limit, callback):
+        if self.log_archive == None:
+            self.out(ROLE, "WARN", "Log archive is disabled")
+            callback([])
+            return
+        threading.Thread(
+            target=self.search_logs, args=(query, since, until, limit, callback), daemon=True
+        ).start()
+
+    def search_logs(self, query, since, until, limit, callback):
+        try:
+            results = self.log_archive.search(query, since, until, limit)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            self.out(ROLE, "ERROR", f"Log search failed: {str(e)}")
+            results = []
+        self.sig_log_search_done.emit(callback, results)
+
+    def when_log_search_done(self, callback, results):
+        callback(results)
+
+    def start_control_server(self):
+        self.control_server = Control_Server(
+            self, self.control_socket or DEFAULT_SOCKET_NAME, self.control_history
+        )
+        try:
+            self.control_server.start()
+        except OSError as e:
+            self.out(ROLE, "ERROR", f"Can't listen on control socket {self.control_server.name}: {str(e)}")
+            self.control_server = None
+
+    def start_metrics_server(self):
+        registry = Metrics_Registry()
+        self.metrics_collector = Metrics_Collector(self, registry)
+        try:
+            self.metrics_server = Metrics_Server(registry, self.metrics_address)
+            self.metrics_server.start()
+        except (OSError, ValueError) as e:
+            self.out(ROLE, "ERROR", f"Can't serve metrics on {self.metrics_address}: {str(e)}")
+            self.metrics_server = None
+
     def start_server(self):
         self.server.start_server()
+        self.backup_manager.start_change_tracker()
         self.update_info_timer.start(self.info_update_interval * 1000)
         if self.auto_backup:
             self.backup_timer.start(self.backup_interval * 1000)
@@ -52,48 +170,253 @@ class Core(QObject):
         self.update_info_timer.stop()
         if self.auto_backup:
             self.backup_timer.stop()
+        self.backup_defer_timer.stop()
+        self.backup_due_time = None
         self.player_cmd_listener.stop()
 
-    def stop_server_and_wait_to_stopped(self):
-        self.server.stop_server_and_wait_to_stopped()
+    def stop_server_then(self, callback):
+        self.server.stop_server_async(lambda result: callback())
         self.update_info_timer.stop()
         if self.auto_backup:
             self.backup_timer.stop()
+        self.backup_defer_timer.stop()
+        self.backup_due_time = None
         self.player_cmd_listener.stop()
 
-    def when_backup_done(self):
-        self.is_backing_up = False
-        self.server.server_exec_and_get_output(
-            "save-on", lambda x: "Automatic saving is now enabled" in x
+    def submit_task(self, task):
+        queued = self.scheduler.submit(task)
+        if queued is not task:
+            self.out(ROLE, "INFO", f"{task.name} is already queued as task #{queued.id}")
+        elif queued.state == "queued":
+            self.out(ROLE, "INFO", f"Queued task #{queued.id}: {queued.name}")
+        return queued
+
+    def run_backup_task(self, name, priority, f, args=(), kind=None, key=None):
+        return self.submit_task(
+            Task(
+                name,
+                priority,
+                f,
+                args,
+                kind=kind,
+                key=key,
+                prepare=self.prepare_backup,
+                finish=self.finish_backup,
+                limited=True,
+            )
         )
 
-    def when_time_to_backup(self):
-        if self.is_backing_up:
-            self.out(ROLE, "WARN", "A backup thread is running")
+    def prepare_backup(self, task, callback):
+        if not self.server.is_running:
+            callback()
+            return
+        self.saving_disabled = True
+        self.server.server_exec("save-off")
+        self.server.request(
+            "save-all",
+            "Saved the game",
+            lambda result: self.when_world_saved(result, callback),
+        )
+
+    def when_world_saved(self, result, callback):
+        if result is None:
+            self.out(ROLE, "WARN", "Timed out waiting for the world to save, backup skipped")
+            self.enable_saving()
+            callback(False)
+            return
+        callback()
+
+    def when_snapshot_done(self):
+        self.enable_saving()
+
+    def finish_backup(self, task):
+        self.enable_saving()
+
+    def enable_saving(self):
+        if not self.saving_disabled:
+            return
+        self.saving_disabled = False
+        if self.server.is_running:
+            self.server.request(
+                "save-on", "Automatic saving is now enabled", self.when_saving_enabled
+            )
+
+    def when_saving_enabled(self, result):
+        if result is None:
+            self.out(ROLE, "WARN", "Timed out waiting for automatic saving to be enabled")
+
+    def run_staged_restore_task(self, name):
+        self.submit_task(
+            Task(
+                f"Stage rollback to {name}",
+                PRIORITY_RESTORE,
+                self.backup_manager.stage_restore,
+                (name,),
+                kind="restore",
+                finish=self.when_restore_staged,
+            )
+        )
+
+    def when_restore_staged(self, task):
+        if task.state != "done" or self.backup_manager.pending_swap == None:
             return
+        self.submit_task(
+            Task(
+                f"Swap in rollback to {self.backup_manager.pending_swap[3]}",
+                PRIORITY_RESTORE,
+                self.backup_manager.swap_staged_restore,
+                kind="restore",
+                prepare=self.prepare_restore,
+                finish=self.finish_restore,
+            )
+        )
+
+    def run_restore_task(self, name, option=None):
+        if option == None:
+            f, args = self.backup_manager.new_branch, (name,)
+        else:
+            f, args = self.backup_manager.restore_partial, (name, option)
+        self.submit_task(
+            Task(
+                f"Rollback to {name}",
+                PRIORITY_RESTORE,
+                f,
+                args,
+                kind="restore",
+                prepare=self.prepare_restore,
+                finish=self.finish_restore,
+            )
+        )
+
+    def prepare_restore(self, task, callback):
+        if self.server.is_running:
+            self.restart_server_later = True
+            self.stop_server_then(callback)
+        else:
+            callback()
+
+    def finish_restore(self, task):
+        if any(queued.priority == PRIORITY_RESTORE for queued in self.scheduler.queued_tasks()):
+            return
+        if self.restart_server_later:
+            self.restart_server_later = False
+            self.start_server()
+
+    def run_maintenance_task(self):
+        self.submit_task(
+            Task(
+                "Repository maintenance",
+                PRIORITY_MAINTENANCE,
+                self.backup_manager.maintain,
+                kind="maintenance",
+                key="maintenance",
+                cancel=self.backup_manager.maintenance.cancel,
+                preemptible=True,
+            )
+        )
+
+    def when_task_started(self, task):
+        self.out(ROLE, "INFO", f"Started task #{task.id}: {task.name}")
+
+    def when_task_done(self, task):
+        if task.state == "failed":
+            self.out(ROLE, "ERROR", f"Task #{task.id} {task.name} failed: {str(task.error)}")
+        elif task.state == "cancelled":
+            self.out(ROLE, "INFO", f"Task #{task.id} {task.name} cancelled")
+
+    def when_time_to_backup(self):
         if self.server.is_running and self.auto_backup:
             if self.backup_when_players_online and self.server.player_count == 0:
                 self.out(ROLE, "INFO", "No player online and skipped the backup")
                 return
-            self.server.server_exec("save-off")
-            self.server.server_exec_and_get_output(
-                "save-all", lambda x: "Saved the game" in x
+            if self.backup_due_time == None and self.skip_unchanged_backups:
+                self.submit_task(
+                    Task(
+                        "Check for world changes",
+                        PRIORITY_AUTO_BACKUP,
+                        self.backup_manager.world_changed,
+                        kind="change_check",
+                        key="change_check",
+                        finish=self.when_world_change_checked,
+                    )
+                )
+                return
+            self.schedule_auto_backup()
+
+    def when_world_change_checked(self, task):
+        if task.state == "cancelled" or not self.server.is_running or not self.auto_backup:
+            return
+        if task.state == "done" and not task.result:
+            self.out(ROLE, "INFO", "World unchanged since the last backup, skipped the backup")
+            return
+        self.schedule_auto_backup()
+
+    def schedule_auto_backup(self):
+        if self.backup_due_time == None:
+            self.backup_due_time = time.time()
+        if not self.backup_defer_timer.isActive() and not self.checking_load:
+            self.check_load_then_backup()
+
+    def check_load_then_backup(self):
+        if self.backup_max_deferral <= 0:
+            self.run_auto_backup()
+            return
+        self.checking_load = True
+        self.load_monitor.check(self.when_load_checked)
+
+    def when_load_checked(self, reasons):
+        self.checking_load = False
+        if self.backup_due_time == None or not self.server.is_running:
+            return
+        waited = time.time() - self.backup_due_time
+        if reasons and waited < self.backup_max_deferral:
+            self.out(ROLE, "INFO", f"Server is under load ({', '.join(reasons)}), backup deferred")
+            delay = min(self.backup_defer_check_interval, self.backup_max_deferral - waited)
+            self.backup_defer_timer.start(int(max(delay, 1) * 1000))
+            return
+        if reasons:
+            self.out(
+                ROLE,
+                "WARN",
+                f"Backup deferred for {int(waited)}s, running it despite load ({', '.join(reasons)})",
             )
-            self.is_backing_up = True
-            self.backup_manager.run_task(self.backup_manager.new_auto_backup)
+        self.run_auto_backup()
+
+    def run_auto_backup(self):
+        self.backup_due_time = None
+        self.run_backup_task(
+            "Auto backup",
+            PRIORITY_AUTO_BACKUP,
+            self.backup_manager.new_auto_backup,
+            kind="auto_backup",
+            key="auto_backup",
+        )
+
+    def when_time_to_maintain(self):
+        if self.scheduler.is_busy():
+            return
+        if self.server.player_count > 0 and not self.maintenance_when_players_online:
+            return
+        self.run_maintenance_task()
 
     def when_about_to_quit(self):
-        if self.is_backing_up:
-            block = Wait_for_a_Signal(self.backup_manager.sig_task_done)
-            block.loop.exec()
+        self.scheduler.shutdown(self.quit_backup_timeout)
+        if self.metrics_server != None:
+            self.metrics_server.stop()
 
         self.backup_manager.when_about_to_quit()
         self.server.when_about_to_quit()
-        self.sig_out.disconnect()
+        if self.control_server != None:
+            self.control_server.stop()
+        if self.log_archive != None:
+            self.log_archive.close()
+        try:
+            self.sig_out.disconnect()
+        except TypeError:
+            pass
 
     def when_detected_player_cmd(self, line):
-        pattern = r"^.+? <(.*?)> \$([a-zA-Z0-9_]+) (.+)$"
-        match = re.match(pattern, line.strip())
+        match = re.match(PLAYER_CMD_PATTERN, line.strip())
 
         if not match:
             return
@@ -112,15 +435,15 @@ class Core(QObject):
             return
         self.core_exec(command, option)
 
-    def out(self, role, flag, line):
+    def format_line(self, role, flag, line):
         current_time = datetime.datetime.now().strftime(self.timestamp_format)
-        self.sig_out.emit(f"[{current_time}] [{role}/{flag}]: {line}")
+        return f"[{current_time}] [{role}/{flag}]: {line}"
+
+    def out(self, role, flag, line):
+        self.sig_out.emit(self.format_line(role, flag, line))
 
     def core_exec(self, command, option):
         if command == "backup":
-            if self.is_backing_up:
-                self.out(ROLE, "WARN", "A backup thread is running")
-                return
             action = option.get("action")
             if action == None:
                 self.out(
@@ -128,33 +451,91 @@ class Core(QObject):
                 )
                 return
             elif action == "new":
-                self.is_backing_up = True
-                self.server.server_exec("save-off")
-                self.server.server_exec_and_get_output(
-                    "save-all", lambda x: "Saved the game" in x
-                )
                 tag = option.get("tag")
                 if tag == None:
-                    self.backup_manager.run_task(self.backup_manager.new_auto_backup)
+                    self.run_backup_task(
+                        "Backup",
+                        PRIORITY_AUTO_BACKUP,
+                        self.backup_manager.new_auto_backup,
+                        kind="auto_backup",
+                        key="auto_backup",
+                    )
                 else:
-                    self.backup_manager.run_task(
-                        self.backup_manager.new_tagged_backup, (tag,)
+                    self.run_backup_task(
+                        f"Backup {tag}",
+                        PRIORITY_TAGGED_BACKUP,
+                        self.backup_manager.new_tagged_backup,
+                        (tag,),
+                        kind="tagged_backup",
                     )
             elif action == "cl":
-                self.is_backing_up = True
-                self.backup_manager.run_task(self.backup_manager.clean)
+                if option.get("full", False):
+                    self.submit_task(
+                        Task(
+                            "Clean repository",
+                            PRIORITY_MAINTENANCE,
+                            self.backup_manager.clean,
+                            kind="clean",
+                            key="clean",
+                        )
+                    )
+                else:
+                    self.run_maintenance_task()
             elif action == "ls":
-                auto_commits = self.backup_manager.get_commit_msg_by_msg_prefix(
-                    self.backup_manager.backup_prefix
+                prefix = option.get("prefix")
+                page = option.get("page", 1)
+                page_size = option.get("page_size")
+                if prefix != None and not isinstance(prefix, str):
+                    self.out(ROLE, "WARN", '"prefix" option for "backup ls" command must be a string')
+                    return
+                if not is_positive_int(page) or (page_size != None and not is_positive_int(page_size)):
+                    self.out(
+                        ROLE,
+                        "WARN",
+                        '"page" and "page_size" options for "backup ls" command must be positive integers',
+                    )
+                    return
+                try:
+                    since = self.parse_backup_time(option.get("since"))
+                    until = self.parse_backup_time(option.get("until"))
+                except ValueError as e:
+                    self.out(ROLE, "WARN", str(e))
+                    return
+                offset = 0 if page_size == None else (page - 1) * page_size
+                args = (prefix, since, until, page_size, offset)
+                if self.backup_manager.catalog.is_empty():
+                    self.submit_task(
+                        Task(
+                            "List backups",
+                            PRIORITY_MAINTENANCE,
+                            self.backup_manager.list_backups,
+                            args,
+                            kind="list",
+                            finish=self.when_backups_listed,
+                        )
+                    )
+                else:
+                    self.out_backups(self.backup_manager.list_backups(*args))
+            elif action == "prune":
+                self.submit_task(
+                    Task(
+                        "Prune backups",
+                        PRIORITY_MAINTENANCE,
+                        self.backup_manager.prune_backups,
+                        (option.get("dry_run", False),),
+                        kind="prune",
+                    )
                 )
-                tagged_commits = self.backup_manager.get_commit_msg_by_msg_prefix(
-                    self.backup_manager.tagged_backup_prefix
+            elif action == "reindex":
+                self.submit_task(
+                    Task(
+                        "Rebuild backup catalog",
+                        PRIORITY_MAINTENANCE,
+                        self.backup_manager.rebuild_catalog,
+                        kind="reindex",
+                        key="reindex",
+                    )
                 )
-                commits = auto_commits + tagged_commits
-                out_str = "list all backups:\n"
-                for branch in commits:
-                    out_str += f"\t{branch}\n"
-                self.out(ROLE, "INFO", out_str)
             elif action == "restore":
                 name = option.get("name")
                 if name == None:
@@ -164,16 +545,57 @@ class Core(QObject):
                         f'"name" option for "backup restore" command is missing',
                     )
                     return
+                elif any(key in option for key in ("paths", "regions", "chunks")):
+                    try:
+                        self.backup_manager.partial_targets(option)
+                    except ValueError as e:
+                        self.out(ROLE, "WARN", f"Invalid partial rollback option: {str(e)}")
+                        return
+                    self.run_restore_task(name, option)
+                elif self.staged_restore:
+                    self.run_staged_restore_task(name)
                 else:
-                    self.is_backing_up = True
-                    restart_later = self.server.is_running
-                    if self.server.is_running:
-                        self.stop_server_and_wait_to_stopped()
-                    self.backup_manager.run_task(
-                        self.backup_manager.new_branch, (name,)
-                    )
-                    if restart_later:
-                        self.start_server()
+                    self.run_restore_task(name)
+
+        elif command == "task":
+            action = option.get("action")
+            if action == None:
+                self.out(ROLE, "WARN", f'"action" option for "task" command is missing')
+                return
+            elif action == "ls":
+                out_str = "list all tasks:\n"
+                for task in self.scheduler.tasks():
+                    out_str += f"\t#{task.id} [{task.state}] {task.name}\n"
+                self.out(ROLE, "INFO", out_str)
+            elif action == "cancel":
+                task = self.scheduler.find(option.get("id"))
+                if task == None:
+                    self.out(ROLE, "WARN", f'Can\'t find task #{option.get("id")}')
+                    return
+                if not self.scheduler.cancel(task):
+                    self.out(ROLE, "WARN", f"Task #{task.id} {task.name} can't be cancelled now")
+
+    def when_backups_listed(self, task):
+        if task.state == "done":
+            self.out_backups(task.result)
+
+    def out_backups(self, commits):
+        out_str = "list all backups:\n"
+        for branch in commits:
+            out_str += f"\t{branch['name']}\n"
+        self.out(ROLE, "INFO", out_str)
+
+    def parse_backup_time(self, value):
+        if value == None:
+            return None
+        try:
+            return int(
+                datetime.datetime.strptime(
+                    str(value), self.backup_manager.backup_timestamp_format
+                ).timestamp()
+            )
+        except ValueError:
+            raise ValueError(f'"{value}" does not match the backup timestamp format')
 
     def exec(self, command):
         if command.startswith("$"):
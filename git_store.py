@@ -0,0 +1,593 @@
+import os
+import json
+import stat
+import hashlib
+import fnmatch
+import zlib
+import time
+import subprocess
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import BoundedSemaphore
+from region import (
+    CHUNKS_SUFFIX,
+    is_region_file,
+    split_region,
+    assemble_region,
+    read_chunks,
+    build_region,
+    is_external_chunk,
+)
+from utils import CREATE_NO_WINDOW
+
+IGNORE_PATTERNS = ["*.lock"]
+IO_LIMIT = None
+MANIFEST_FILE = "backup_manifest.json"
+DEFAULT_IDENT = b"Minecraft Server GUI <backup@localhost>"
+
+
+def object_hash(kind, data):
+    return hashlib.sha1(b"%s %d\0" % (kind, len(data)) + data).hexdigest()
+
+
+def blob_hash(data):
+    return object_hash(b"blob", data)
+
+
+def quote_path(path):
+    if b"\n" in path or b"\\" in path or path.startswith(b'"'):
+        path = path.replace(b"\\", b"\\\\").replace(b'"', b'\\"').replace(b"\n", b"\\n")
+        return b'"' + path + b'"'
+    return path
+
+
+def write_loose_object(objects_dir, sha, data, level, kind=b"blob"):
+    object_path = os.path.join(objects_dir, sha[:2], sha[2:])
+    if os.path.exists(object_path):
+        return 0
+    compressed = zlib.compress(b"%s %d\0" % (kind, len(data)) + data, level)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    temp_path = f"{object_path}.{os.getpid()}.tmp"
+    with io_limit():
+        with open(temp_path, "wb") as f:
+            f.write(compressed)
+    os.replace(temp_path, object_path)
+    return len(data)
+
+
+def init_worker(limit):
+    global IO_LIMIT
+    IO_LIMIT = limit
+
+
+def io_limit():
+    return nullcontext() if IO_LIMIT is None else IO_LIMIT
+
+
+def create_executor(workers, io_concurrency):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(BoundedSemaphore(io_concurrency),),
+    )
+
+
+def store_file(objects_dir, root, path, region_dedup, existing, level):
+    try:
+        with io_limit():
+            with open(os.path.join(root, path), "rb") as f:
+                data = f.read()
+    except OSError:
+        return path, None, 0
+    parts = None
+    if region_dedup and is_region_file(path):
+        parts = split_region(data)
+    if parts is None:
+        parts = {None: data}
+    objects = {}
+    written = 0
+    for name, part in parts.items():
+        sha = blob_hash(part)
+        objects[name] = sha
+        if sha not in existing:
+            written += write_loose_object(objects_dir, sha, part, level)
+    if None in objects:
+        return path, objects[None], written
+    return path, objects, written
+
+
+def manifest_objects(files):
+    objects = set()
+    for entry in files.values():
+        if isinstance(entry[3], dict):
+            objects.update(entry[3].values())
+        else:
+            objects.add(entry[3])
+    return objects
+
+
+class Git_Store:
+    def __init__(
+        self,
+        git_dir,
+        ignore=IGNORE_PATTERNS,
+        region_dedup=False,
+        workers=0,
+        io_concurrency=4,
+        compression_level=1,
+        executor=None,
+    ):
+        self.git_dir = git_dir
+        self.ignore = ignore
+        self.region_dedup = region_dedup
+        self.workers = workers
+        self.io_concurrency = io_concurrency
+        self.compression_level = compression_level
+        self.executor = executor
+        self.owns_executor = executor is None
+        self.manifest_path = os.path.join(self.git_dir, MANIFEST_FILE)
+
+    def git(self, *args, **kwargs):
+        return subprocess.run(
+            ["git", "--git-dir", self.git_dir, *args],
+            check=True,
+            creationflags=CREATE_NO_WINDOW,
+            **kwargs,
+        )
+
+    def git_output(self, *args):
+        return subprocess.check_output(
+            ["git", "--git-dir", self.git_dir, *args],
+            creationflags=CREATE_NO_WINDOW,
+        )
+
+    def init(self):
+        if not os.path.exists(os.path.join(self.git_dir, "HEAD")):
+            os.makedirs(self.git_dir, exist_ok=True)
+            self.git("init", "--bare")
+        info_dir = os.path.join(self.git_dir, "info")
+        os.makedirs(info_dir, exist_ok=True)
+        with open(os.path.join(info_dir, "exclude"), "w") as f:
+            f.write("".join(pattern + "\n" for pattern in self.ignore))
+        with open(os.path.join(info_dir, "attributes"), "w") as f:
+            f.write("* binary\n")
+
+    def is_ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def is_ignored_path(self, path):
+        return any(self.is_ignored(name) for name in path.split("/"))
+
+    def stat_entry(self, full_path):
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        mode = "100755" if st.st_mode & stat.S_IXUSR else "100644"
+        return (st.st_mtime_ns, st.st_size, mode)
+
+    def head_ref(self):
+        return self.git_output("symbolic-ref", "HEAD").decode().strip()
+
+    def resolve(self, rev):
+        try:
+            output = subprocess.check_output(
+                ["git", "--git-dir", self.git_dir, "rev-parse", "--verify", "-q", rev + "^{commit}"],
+                stderr=subprocess.DEVNULL,
+                creationflags=CREATE_NO_WINDOW,
+            )
+        except subprocess.CalledProcessError:
+            return None
+        return output.decode().strip()
+
+    def committer(self):
+        try:
+            ident = self.git_output("var", "GIT_COMMITTER_IDENT").strip()
+        except subprocess.CalledProcessError:
+            return None
+        return ident
+
+    def scan(self, root):
+        files = {}
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names[:] = [name for name in dir_names if not self.is_ignored(name)]
+            for name in file_names:
+                if self.is_ignored(name):
+                    continue
+                full_path = os.path.join(dir_path, name)
+                entry = self.stat_entry(full_path)
+                if entry == None:
+                    continue
+                files[os.path.relpath(full_path, root).replace(os.sep, "/")] = entry
+        return files
+
+    def load_manifest(self, commit):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if commit is None or manifest.get("commit") != commit:
+            return {}
+        return manifest.get("files", {})
+
+    def save_manifest(self, commit, files):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"commit": commit, "files": files}, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def write_commit(self, root, message, files=None):
+        self.init()
+        ref = self.head_ref()
+        parent = self.resolve(ref)
+        previous = self.load_manifest(parent)
+        known = manifest_objects(previous)
+        if files == None:
+            files = self.scan(root)
+        ident = self.committer() or b"%s %d +0000" % (DEFAULT_IDENT, int(time.time()))
+        message = message.encode("utf-8")
+        stored = {}
+        written = 0
+        if self.workers > 1:
+            changed_paths = [
+                path
+                for path, (mtime, size, mode) in files.items()
+                if path not in previous
+                or previous[path][0] != mtime
+                or previous[path][1] != size
+            ]
+            if len(changed_paths) > 1:
+                stored, written = self.store_files(root, changed_paths, previous)
+
+        process = subprocess.Popen(
+            ["git", "--git-dir", self.git_dir, "fast-import", "--quiet", "--done"],
+            stdin=subprocess.PIPE,
+            creationflags=CREATE_NO_WINDOW,
+        )
+        stream = process.stdin
+        manifest = {}
+        changed = 0
+        try:
+            stream.write(b"commit %s\n" % ref.encode())
+            stream.write(b"committer %s\n" % ident)
+            stream.write(b"data %d\n%s\n" % (len(message), message))
+            if parent is not None:
+                stream.write(b"from %s\n" % parent.encode())
+            stream.write(b"deleteall\n")
+            for path, (mtime, size, mode) in files.items():
+                entry = previous.get(path)
+                if entry is not None and entry[0] == mtime and entry[1] == size:
+                    manifest[path] = entry
+                    self.write_references(stream, path, mode, entry[3])
+                    continue
+                if path in stored:
+                    if stored[path] is not None:
+                        manifest[path] = [mtime, size, mode, stored[path]]
+                        self.write_references(stream, path, mode, stored[path])
+                        changed += 1
+                    continue
+                try:
+                    with open(os.path.join(root, path), "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                parts = None
+                if self.region_dedup and is_region_file(path):
+                    parts = split_region(data)
+                if parts is None:
+                    objects = blob_hash(data)
+                    written += self.write_blob(stream, path, mode, objects, data, known)
+                else:
+                    objects = {}
+                    for name, part in parts.items():
+                        objects[name] = blob_hash(part)
+                        part_path = path + CHUNKS_SUFFIX + "/" + name
+                        written += self.write_blob(stream, part_path, mode, objects[name], part, known)
+                manifest[path] = [mtime, size, mode, objects]
+                changed += 1
+            stream.write(b"\ndone\n")
+            stream.close()
+        except BrokenPipeError:
+            pass
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, "git fast-import")
+        commit = self.resolve(ref)
+        self.save_manifest(commit, manifest)
+        size = sum(entry[1] for entry in manifest.values())
+        return {
+            "commit": commit,
+            "files": len(manifest),
+            "changed": changed,
+            "bytes": written,
+            "size": size,
+        }
+
+    def store_files(self, root, paths, previous):
+        if self.executor is None:
+            self.executor = create_executor(self.workers, self.io_concurrency)
+        objects_dir = os.path.join(self.git_dir, "objects")
+        futures = []
+        for path in paths:
+            existing = set()
+            if path in previous:
+                existing = manifest_objects({path: previous[path]})
+            futures.append(
+                self.executor.submit(
+                    store_file,
+                    objects_dir,
+                    root,
+                    path,
+                    self.region_dedup,
+                    existing,
+                    self.compression_level,
+                )
+            )
+        stored = {}
+        written = 0
+        for future in as_completed(futures):
+            path, objects, size = future.result()
+            stored[path] = objects
+            written += size
+        return stored, written
+
+    def close(self):
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def write_references(self, stream, path, mode, objects):
+        if isinstance(objects, dict):
+            for name, sha in objects.items():
+                part_path = quote_path(os.fsencode(path + CHUNKS_SUFFIX + "/" + name))
+                stream.write(b"M %s %s %s\n" % (mode.encode(), sha.encode(), part_path))
+        else:
+            stream.write(b"M %s %s %s\n" % (mode.encode(), objects.encode(), quote_path(os.fsencode(path))))
+
+    def write_blob(self, stream, path, mode, sha, data, known):
+        if sha in known:
+            stream.write(b"M %s %s %s\n" % (mode.encode(), sha.encode(), quote_path(os.fsencode(path))))
+            return 0
+        known.add(sha)
+        stream.write(b"M %s inline %s\n" % (mode.encode(), quote_path(os.fsencode(path))))
+        stream.write(b"data %d\n" % len(data))
+        stream.write(data)
+        stream.write(b"\n")
+        return len(data)
+
+    def list_tree(self, commit):
+        output = self.git_output("ls-tree", "-r", "-z", "--full-tree", commit)
+        entries = {}
+        for record in output.split(b"\0"):
+            if not record:
+                continue
+            info, path = record.split(b"\t", 1)
+            mode, kind, sha = info.split(b" ")
+            if kind != b"blob":
+                continue
+            path = os.fsdecode(path)
+            marker = path.rfind(CHUNKS_SUFFIX + "/")
+            if marker == -1:
+                entries[path] = (mode.decode(), sha.decode())
+                continue
+            file_path = path[:marker]
+            name = path[marker + len(CHUNKS_SUFFIX) + 1 :]
+            parts = entries.setdefault(file_path, (mode.decode(), {}))[1]
+            parts[name] = sha.decode()
+        return entries
+
+    def read_blob(self, process, sha):
+        process.stdin.write(sha.encode() + b"\n")
+        process.stdin.flush()
+        header = process.stdout.readline().split()
+        size = int(header[2])
+        data = process.stdout.read(size)
+        process.stdout.read(1)
+        return data
+
+    def read_object(self, process, objects):
+        if isinstance(objects, dict):
+            parts = {name: self.read_blob(process, sha) for name, sha in objects.items()}
+            return assemble_region(parts)
+        return self.read_blob(process, objects)
+
+    def open_reader(self):
+        return subprocess.Popen(
+            ["git", "--git-dir", self.git_dir, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            creationflags=CREATE_NO_WINDOW,
+        )
+
+    def close_reader(self, process):
+        process.stdin.close()
+        process.wait()
+
+    def write_file(self, root, path, mode, data):
+        full_path = os.path.join(root, *path.split("/"))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(data)
+        if mode == "100755":
+            os.chmod(full_path, 0o755)
+        return full_path
+
+    def extract_paths(self, commit, root, patterns):
+        entries = self.list_tree(commit)
+        selected = {
+            path: entry
+            for path, entry in entries.items()
+            if any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+        }
+        process = self.open_reader()
+        written = 0
+        try:
+            for path, (mode, objects) in selected.items():
+                data = self.read_object(process, objects)
+                self.write_file(root, path, mode, data)
+                written += len(data)
+        finally:
+            self.close_reader(process)
+        removed = 0
+        for path in self.scan(root):
+            if path not in selected and any(fnmatch.fnmatch(path, pattern) for pattern in patterns):
+                os.remove(os.path.join(root, *path.split("/")))
+                removed += 1
+        return {"files": len(selected), "written": written, "removed": removed}
+
+    def extract_chunks(self, commit, root, dimension, chunk_from, chunk_to):
+        entries = self.list_tree(commit)
+        min_x, max_x = sorted((chunk_from[0], chunk_to[0]))
+        min_z, max_z = sorted((chunk_from[1], chunk_to[1]))
+        prefix = dimension.strip("/") + "/" if dimension.strip("/") else ""
+        process = self.open_reader()
+        replaced = 0
+        removed = 0
+        try:
+            for folder in ("region", "entities", "poi"):
+                for region_x in range(min_x >> 5, (max_x >> 5) + 1):
+                    for region_z in range(min_z >> 5, (max_z >> 5) + 1):
+                        path = f"{prefix}{folder}/r.{region_x}.{region_z}.mca"
+                        full_path = os.path.join(root, *path.split("/"))
+                        backup_chunks = {}
+                        if path in entries:
+                            backup_chunks = read_chunks(self.read_object(process, entries[path][1]))
+                        live_data = None
+                        if os.path.exists(full_path):
+                            with open(full_path, "rb") as f:
+                                live_data = f.read()
+                        if live_data is None and not backup_chunks:
+                            continue
+                        live_chunks = read_chunks(live_data)
+                        for chunk_x in range(max(min_x, region_x * 32), min(max_x, region_x * 32 + 31) + 1):
+                            for chunk_z in range(max(min_z, region_z * 32), min(max_z, region_z * 32 + 31) + 1):
+                                index = (chunk_x & 31) + (chunk_z & 31) * 32
+                                external = f"{prefix}{folder}/c.{chunk_x}.{chunk_z}.mcc"
+                                external_path = os.path.join(root, *external.split("/"))
+                                if index in backup_chunks:
+                                    live_chunks[index] = backup_chunks[index]
+                                    replaced += 1
+                                    if is_external_chunk(backup_chunks[index][0]) and external in entries:
+                                        mode, objects = entries[external]
+                                        self.write_file(root, external, mode, self.read_object(process, objects))
+                                elif live_chunks.pop(index, None) is not None:
+                                    removed += 1
+                                    if os.path.exists(external_path):
+                                        os.remove(external_path)
+                        mode = entries[path][0] if path in entries else "100644"
+                        self.write_file(root, path, mode, build_region(live_chunks))
+        finally:
+            self.close_reader(process)
+        return {"replaced": replaced, "removed": removed}
+
+    def materialize(self, commit, root):
+        self.init()
+        os.makedirs(root, exist_ok=True)
+        entries = self.list_tree(commit)
+        previous = self.load_manifest(self.resolve("HEAD"))
+        current = self.scan(root)
+        manifest = {}
+
+        process = self.open_reader()
+        written = 0
+        try:
+            for path, (mode, objects) in entries.items():
+                entry = previous.get(path)
+                state = current.get(path)
+                if (
+                    entry is not None
+                    and state is not None
+                    and entry[3] == objects
+                    and entry[0] == state[0]
+                    and entry[1] == state[1]
+                ):
+                    manifest[path] = entry
+                    continue
+                data = self.read_object(process, objects)
+                st = os.stat(self.write_file(root, path, mode, data))
+                manifest[path] = [st.st_mtime_ns, st.st_size, mode, objects]
+                written += len(data)
+        finally:
+            self.close_reader(process)
+
+        removed = 0
+        for path in current:
+            if path not in entries:
+                os.remove(os.path.join(root, *path.split("/")))
+                removed += 1
+        return {"files": len(entries), "written": written, "removed": removed, "manifest": manifest}
+
+    def switch_branch(self, branch_name, commit, manifest=None):
+        self.git("update-ref", "refs/heads/" + branch_name, commit)
+        self.git("symbolic-ref", "HEAD", "refs/heads/" + branch_name)
+        if manifest is not None:
+            self.save_manifest(commit, manifest)
+
+    def list_refs(self):
+        output = self.git_output("for-each-ref", "--format=%(objectname) %(objecttype) %(refname)")
+        refs = {}
+        for line in output.decode().split("\n"):
+            if not line:
+                continue
+            sha, kind, ref = line.split(" ", 2)
+            if kind == "commit":
+                refs[ref] = sha
+        return refs
+
+    def rewrite_history(self, prune):
+        refs = self.list_refs()
+        prune = set(prune) - set(refs.values())
+        if not prune:
+            return prune, {}
+        order = self.git_output("rev-list", "--topo-order", "--reverse", *set(refs.values())).decode().split()
+        objects_dir = os.path.join(self.git_dir, "objects")
+        mapping = {}
+        rewritten = {}
+        process = self.open_reader()
+        try:
+            for commit in order:
+                header, body = self.read_blob(process, commit).split(b"\n\n", 1)
+                lines = header.split(b"\n")
+                parents = [line[7:].decode() for line in lines if line.startswith(b"parent ")]
+                new_parents = []
+                for parent in parents:
+                    for new_parent in mapping[parent]:
+                        if new_parent not in new_parents:
+                            new_parents.append(new_parent)
+                if commit in prune:
+                    mapping[commit] = new_parents
+                    continue
+                if new_parents == parents:
+                    mapping[commit] = [commit]
+                    continue
+                lines = [line for line in lines if not line.startswith(b"parent ")]
+                lines[1:1] = [b"parent " + parent.encode() for parent in new_parents]
+                data = b"\n".join(lines) + b"\n\n" + body
+                sha = object_hash(b"commit", data)
+                write_loose_object(objects_dir, sha, data, self.compression_level, b"commit")
+                mapping[commit] = [sha]
+                rewritten[commit] = sha
+        finally:
+            self.close_reader(process)
+
+        updates = b"".join(
+            b"update %s %s %s\n" % (ref.encode(), rewritten[sha].encode(), sha.encode())
+            for ref, sha in refs.items()
+            if sha in rewritten
+        )
+        if updates:
+            self.git("update-ref", "--stdin", input=updates)
+        self.git("reflog", "expire", "--expire-unreachable=now", "--all")
+        self.remap_manifest(rewritten)
+        return prune, rewritten
+
+    def remap_manifest(self, rewritten):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("commit") in rewritten:
+            self.save_manifest(rewritten[manifest["commit"]], manifest.get("files", {}))
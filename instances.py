@@ -0,0 +1,91 @@
+import os
+from PyQt5.QtCore import QObject, pyqtSignal
+from core import Core
+from git_store import create_executor
+from scheduler import Task_Limiter
+
+PATH_SETTINGS = ("src_dir", "git_dir", "work_dir")
+WORLD_SETTINGS = ("snapshot_dir", "restore_staging_dir", "restore_rollback_dir")
+
+
+def instance_settings(settings, name, overrides):
+    merged = {key: value for key, value in settings.items() if key != "instances"}
+    if "metrics_address" not in overrides:
+        merged.pop("metrics_address", None)
+    if merged.get("control_socket") and "control_socket" not in overrides:
+        merged["control_socket"] = f"{merged['control_socket']}-{name}"
+    for key in WORLD_SETTINGS:
+        if key not in overrides:
+            merged.pop(key, None)
+    merged.update(overrides)
+    if "log_archive_dir" not in overrides:
+        merged["log_archive_dir"] = os.path.join(
+            merged.get("log_archive_dir", os.path.join(merged.get("work_dir", "."), "log_archive")),
+            name,
+        )
+    for key in PATH_SETTINGS:
+        if key in merged:
+            merged[key] = os.path.abspath(merged[key])
+    return merged
+
+
+def control_sockets(settings):
+    instances = settings.get("instances")
+    if not instances:
+        return [(None, settings.get("control_socket"))]
+    return [
+        (name, instance_settings(settings, name, overrides).get("control_socket"))
+        for name, overrides in instances.items()
+    ]
+
+
+class Instance_Manager(QObject):
+    sig_shutdown_requested = pyqtSignal()
+
+    def __init__(self, settings):
+        super().__init__()
+        self.limiter = None
+        self.executor = None
+        self.cores = []
+        instances = settings.get("instances")
+        if not instances:
+            self.add(None, Core(settings))
+            return
+
+        configs = [
+            (name, instance_settings(settings, name, overrides))
+            for name, overrides in instances.items()
+        ]
+        for key in ("src_dir", "git_dir") + WORLD_SETTINGS:
+            owners = {}
+            for name, config in configs:
+                path = config.get(key)
+                if path == None:
+                    continue
+                path = os.path.normcase(os.path.abspath(path))
+                if path in owners:
+                    raise ValueError(
+                        f'Instances "{owners[path]}" and "{name}" share the same "{key}", please give each instance its own'
+                    )
+                owners[path] = name
+
+        self.limiter = Task_Limiter(
+            settings.get("max_concurrent_backups", 1), settings.get("backup_stagger", 60)
+        )
+        self.executor = create_executor(
+            settings.get("backup_workers", min(4, os.cpu_count() or 1)),
+            settings.get("backup_io_concurrency", 4),
+        )
+        for name, config in configs:
+            self.add(name, Core(config, name, self.limiter, self.executor))
+
+    def add(self, name, core):
+        core.sig_shutdown_requested.connect(self.sig_shutdown_requested)
+        self.cores.append((name, core))
+
+    def when_about_to_quit(self):
+        for name, core in self.cores:
+            core.when_about_to_quit()
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,104 @@
+import os
+import time
+from collections import deque
+import psutil
+
+
+class Load_Monitor:
+    def __init__(self, server, settings):
+        self.server = server
+        self.max_mspt = settings.get("backup_defer_mspt", 40)
+        self.max_cpu = settings.get("backup_defer_cpu_percent", 85)
+        self.max_io = settings.get("backup_defer_io_percent", 80)
+        self.window = settings.get("backup_defer_load_window", 10)
+        self.samples = deque()
+        self.last_cpu = None
+        self.last_io = None
+        self.disk = self.find_disk(settings.get("src_dir"))
+        self.cpu_busy_percent()
+        self.io_busy_percent()
+
+    def cpu_busy_percent(self):
+        times = psutil.cpu_times()
+        idle = times.idle + getattr(times, "iowait", 0)
+        total = sum(times) - getattr(times, "guest", 0) - getattr(times, "guest_nice", 0)
+        last_cpu = self.last_cpu
+        self.last_cpu = (total, total - idle)
+        if last_cpu == None or total <= last_cpu[0]:
+            return None
+        return min(100.0, max(0.0, (total - idle - last_cpu[1]) * 100 / (total - last_cpu[0])))
+
+    def find_disk(self, path):
+        if path == None:
+            return None
+        path = os.path.realpath(path)
+        try:
+            partitions = psutil.disk_partitions()
+        except (OSError, RuntimeError):
+            return None
+        best = None
+        for partition in partitions:
+            mountpoint = partition.mountpoint
+            if path == mountpoint or path.startswith(mountpoint.rstrip(os.sep) + os.sep):
+                if best == None or len(mountpoint) > len(best.mountpoint):
+                    best = partition
+        if best == None:
+            return None
+        return os.path.basename(os.path.realpath(best.device))
+
+    def io_busy_percent(self):
+        try:
+            counters = psutil.disk_io_counters(perdisk=True)
+        except (OSError, RuntimeError):
+            counters = None
+        if not counters:
+            return None
+        if self.disk in counters:
+            counters = {self.disk: counters[self.disk]}
+        busy = {}
+        for disk, counter in counters.items():
+            if hasattr(counter, "busy_time"):
+                busy[disk] = counter.busy_time
+            else:
+                busy[disk] = counter.read_time + counter.write_time
+        now = time.monotonic()
+        last_io = self.last_io
+        self.last_io = (now, busy)
+        if last_io == None or now <= last_io[0]:
+            return None
+        percents = [
+            (busy[disk] - last_io[1][disk]) / ((now - last_io[0]) * 10)
+            for disk in busy
+            if disk in last_io[1]
+        ]
+        if not percents:
+            return None
+        return min(100.0, max(0.0, max(percents)))
+
+    def sample(self):
+        now = time.monotonic()
+        self.samples.append((now, self.cpu_busy_percent(), self.io_busy_percent()))
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def average(self, index):
+        since = time.monotonic() - self.window
+        values = [
+            sample[index] for sample in self.samples if sample[0] >= since and sample[index] != None
+        ]
+        return sum(values) / len(values) if values else None
+
+    def check(self, callback):
+        self.server.query_tick_health(lambda mspt: callback(self.reasons(mspt)))
+
+    def reasons(self, mspt):
+        reasons = []
+        if mspt != None and mspt > self.max_mspt:
+            reasons.append(f"MSPT {mspt:.1f}ms")
+        cpu = self.average(1)
+        if cpu != None and cpu > self.max_cpu:
+            reasons.append(f"CPU {cpu:.0f}%")
+        io = self.average(2)
+        if io != None and io > self.max_io:
+            reasons.append(f"disk {io:.0f}% busy")
+        return reasons
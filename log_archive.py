@@ -0,0 +1,292 @@
+import os
+import re
+import time
+import zlib
+import queue
+import sqlite3
+import datetime
+import threading
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+INDEX_FILE = "log_index.sqlite"
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".log.z"
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 64
+DURATION_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def tokenize(text):
+    return {token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(text.lower())}
+
+
+def parse_query(query):
+    terms, prefixes = set(), set()
+    for word in query.lower().split():
+        tokens = [token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(word)]
+        if not tokens:
+            continue
+        if word.endswith("*"):
+            prefixes.add(tokens.pop())
+        terms.update(tokens)
+    return terms, prefixes
+
+
+def line_matches(line, terms, prefixes):
+    if not terms and not prefixes:
+        return True
+    lowered = line.lower()
+    if not all(term in lowered for term in terms) or not all(prefix in lowered for prefix in prefixes):
+        return False
+    tokens = tokenize(lowered)
+    if not terms <= tokens:
+        return False
+    return all(any(token.startswith(prefix) for token in tokens) for prefix in prefixes)
+
+
+def parse_time(value, now=None):
+    match = DURATION_PATTERN.match(value)
+    if match:
+        now = time.time() if now == None else now
+        return now - float(match.group(1)) * DURATION_UNITS[match.group(2)]
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def parse_search_text(text):
+    words, since, until = [], None, None
+    for word in text.split():
+        key, _, value = word.partition(":")
+        if key in ("since", "until") and value:
+            try:
+                if key == "since":
+                    since = parse_time(value)
+                else:
+                    until = parse_time(value)
+                continue
+            except ValueError:
+                pass
+        words.append(word)
+    return " ".join(words), since, until
+
+
+def encode_block(records):
+    data = "".join(f"{timestamp}\t{line}\n" for timestamp, line in records)
+    return zlib.compress(data.encode("utf-8"))
+
+
+def decode_block(data):
+    records = []
+    for record in zlib.decompress(data).decode("utf-8").split("\n")[:-1]:
+        timestamp, _, line = record.partition("\t")
+        records.append((int(timestamp), line))
+    return records
+
+
+class Log_Archive(QObject):
+    sig_error = pyqtSignal(str)
+
+    def __init__(
+        self,
+        archive_dir,
+        segment_size=16 << 20,
+        max_age=None,
+        block_lines=1000,
+        flush_interval=5,
+    ):
+        super().__init__()
+        self.archive_dir = archive_dir
+        self.index_path = os.path.join(self.archive_dir, INDEX_FILE)
+        self.segment_size = segment_size
+        self.max_age = max_age
+        self.block_lines = block_lines
+        self.lock = threading.Lock()
+        self.pending = []
+        self.unindexed = {}
+        self.jobs = queue.Queue()
+        self.failed = False
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(int(flush_interval * 1000))
+        self.flush_timer.timeout.connect(self.flush)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        connection = self.connect()
+        row = connection.execute("SELECT id, segment FROM blocks ORDER BY id DESC LIMIT 1").fetchone()
+        connection.close()
+        self.next_block = 1 if row == None else row[0] + 1
+        self.segment = None if row == None else row[1]
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def connect(self):
+        connection = sqlite3.connect(self.index_path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            "id INTEGER PRIMARY KEY, segment TEXT NOT NULL, offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, first_time INTEGER NOT NULL, last_time INTEGER NOT NULL, "
+            "line_count INTEGER NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS blocks_time ON blocks (last_time, first_time)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "token TEXT NOT NULL, block INTEGER NOT NULL, PRIMARY KEY (token, block)) WITHOUT ROWID"
+        )
+        return connection
+
+    def append(self, text):
+        self.append_lines(text.splitlines())
+
+    def append_lines(self, lines):
+        timestamp = int(time.time() * 1000)
+        with self.lock:
+            self.pending.extend((timestamp, line) for line in lines)
+            full = len(self.pending) >= self.block_lines
+        if full:
+            self.flush()
+        elif not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        self.flush_timer.stop()
+        with self.lock:
+            if not self.pending:
+                return
+            records, self.pending = self.pending, []
+            block_id = self.next_block
+            self.next_block += 1
+            self.unindexed[block_id] = records
+        self.jobs.put((block_id, records))
+
+    def work(self):
+        connection = self.connect()
+        while True:
+            job = self.jobs.get()
+            if job == None:
+                break
+            block_id, records = job
+            try:
+                self.write_block(connection, block_id, records)
+                self.failed = False
+            except (OSError, sqlite3.Error) as e:
+                if not self.failed:
+                    self.failed = True
+                    self.sig_error.emit(f"Failed to archive logs: {str(e)}")
+            with self.lock:
+                self.unindexed.pop(block_id, None)
+        connection.close()
+
+    def write_block(self, connection, block_id, records):
+        data = encode_block(records)
+        segment_path = None if self.segment == None else os.path.join(self.archive_dir, self.segment)
+        if segment_path == None or not os.path.exists(segment_path) or (
+            os.path.getsize(segment_path) + len(data) > self.segment_size
+        ):
+            self.segment = f"{SEGMENT_PREFIX}{records[0][0]}{SEGMENT_SUFFIX}"
+            segment_path = os.path.join(self.archive_dir, self.segment)
+            self.expire(connection)
+        with open(segment_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+        tokens = set()
+        for _, line in records:
+            tokens |= tokenize(line)
+        with connection:
+            connection.execute(
+                "INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (block_id, self.segment, offset, len(data), records[0][0], records[-1][0], len(records)),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO tokens VALUES (?, ?)", [(token, block_id) for token in tokens]
+            )
+
+    def expire(self, connection):
+        if self.max_age == None:
+            return
+        cutoff = int((time.time() - self.max_age) * 1000)
+        segments = [
+            row[0]
+            for row in connection.execute(
+                "SELECT segment FROM blocks GROUP BY segment HAVING MAX(last_time) < ?", (cutoff,)
+            )
+        ]
+        for segment in segments:
+            with connection:
+                connection.execute(
+                    "DELETE FROM tokens WHERE block IN (SELECT id FROM blocks WHERE segment = ?)",
+                    (segment,),
+                )
+                connection.execute("DELETE FROM blocks WHERE segment = ?", (segment,))
+            try:
+                os.remove(os.path.join(self.archive_dir, segment))
+            except FileNotFoundError:
+                pass
+
+    def candidate_blocks(self, connection, terms, prefixes, since, until):
+        sql = "SELECT id, segment, offset, length FROM blocks WHERE last_time >= ? AND first_time <= ?"
+        params = [since, until]
+        for term in terms:
+            sql += " AND id IN (SELECT block FROM tokens WHERE token = ?)"
+            params.append(term)
+        for prefix in prefixes:
+            sql += " AND id IN (SELECT block FROM tokens WHERE token >= ? AND token < ?)"
+            params += [prefix, prefix + "\U0010ffff"]
+        return connection.execute(sql + " ORDER BY id DESC", params)
+
+    def search(self, query="", since=None, until=None, limit=200):
+        terms, prefixes = parse_query(query)
+        since = 0 if since == None else int(since * 1000)
+        until = int(time.time() * 1000) if until == None else int(until * 1000)
+        with self.lock:
+            recent = [records for _, records in sorted(self.unindexed.items())]
+            recent.append(list(self.pending))
+            seen = set(self.unindexed)
+
+        results = []
+
+        def collect(records):
+            for timestamp, line in reversed(records):
+                if since <= timestamp <= until and line_matches(line, terms, prefixes):
+                    results.append((timestamp / 1000, line))
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        for records in reversed(recent):
+            if collect(records):
+                results.reverse()
+                return results
+        connection = self.connect()
+        f, open_segment = None, None
+        try:
+            for block_id, segment, offset, length in self.candidate_blocks(
+                connection, terms, prefixes, since, until
+            ):
+                if block_id in seen:
+                    continue
+                if segment != open_segment:
+                    if f != None:
+                        f.close()
+                    f, open_segment = None, segment
+                    try:
+                        f = open(os.path.join(self.archive_dir, segment), "rb")
+                    except FileNotFoundError:
+                        pass
+                if f == None:
+                    continue
+                f.seek(offset)
+                if collect(decode_block(f.read(length))):
+                    break
+        finally:
+            if f != None:
+                f.close()
+            connection.close()
+        results.reverse()
+        return results
+
+    def close(self):
+        self.flush()
+        self.jobs.put(None)
+        self.worker.join()
@@ -1,28 +1,129 @@
-from PyQt5.QtWidgets import QApplication
 import sys
 import json
 import os
-from ui import UI
+import signal
+import argparse
+from control import Control_Client, DEFAULT_SOCKET_NAME, is_listening
 CONFIG_FILE="config.json"
 
-if __name__ == "__main__":
 
-    with open(CONFIG_FILE, "r", encoding="utf-8") as configfile:
+def load_settings(config_file):
+    with open(config_file, "r", encoding="utf-8") as configfile:
         config = json.load(configfile)
     settings = config["settings"]
-    settings["git_dir"]=os.path.abspath(settings["git_dir"])
-    settings["src_dir"]=os.path.abspath(settings["src_dir"])
-    settings["tray_icon"]=os.path.abspath(settings["tray_icon"])
-    settings["window_icon"]=os.path.abspath(settings["window_icon"])
-    settings["stylesheet"]=os.path.abspath(settings["stylesheet"])
+    for key in ("git_dir", "src_dir", "tray_icon", "window_icon", "stylesheet"):
+        if key in settings:
+            settings[key]=os.path.abspath(settings[key])
+    return settings
+
+
+def print_lines(lines, name=None):
+    if name != None:
+        lines = [f"[{name}] {line}" for line in lines]
+    print("\n".join(lines), flush=True)
+
+
+def default_control_socket(settings):
+    if not settings.get("control_socket"):
+        settings["control_socket"] = DEFAULT_SOCKET_NAME
+
+
+def attach_targets(settings, attach):
+    from instances import control_sockets
+
+    default_control_socket(settings)
+    targets = control_sockets(settings)
+    if attach:
+        targets = [(name, socket_name) for name, socket_name in targets if name == attach] or [
+            (None, attach)
+        ]
+    return targets
+
+
+def run_headless(settings):
+    from PyQt5.QtCore import QCoreApplication, QTimer
+    from instances import Instance_Manager, control_sockets
+
+    app = QCoreApplication(sys.argv)
+    default_control_socket(settings)
+    for name, socket_name in control_sockets(settings):
+        if socket_name and is_listening(socket_name):
+            print(f'Another instance is already listening on "{socket_name}"', file=sys.stderr)
+            return 1
+    instances = Instance_Manager(settings)
+    for name, core in instances.cores:
+        print_line = lambda line, name=name: print_lines([line], name)
+        core.sig_out.connect(print_line)
+        core.server.sig_out.connect(print_line)
+        core.backup_manager.sig_out.connect(print_line)
+        core.server.sig_server_lines.connect(lambda lines, name=name: print_lines(lines, name))
+    instances.sig_shutdown_requested.connect(app.quit)
+    app.aboutToQuit.connect(instances.when_about_to_quit)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: app.quit())
+    # Give the interpreter a chance to run the signal handlers above.
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
+    return app.exec_()
+
+
+def run_ui(settings, attach=None):
+    from PyQt5.QtWidgets import QApplication
+    from ui import UI
 
-    work_dir=os.path.abspath(settings["work_dir"])
-    os.chdir(work_dir)
     app = QApplication.instance()
     if app is None:
         app = QApplication(sys.argv)
 
-    ui_instance = UI(settings)
-    app.aboutToQuit.connect(ui_instance.when_about_to_quit)
+    if attach != None:
+        clients = []
+        for name, socket_name in attach_targets(settings, attach):
+            client = Control_Client(socket_name, settings.get("timestamp_format", "%H:%M:%S"))
+            if not client.connect_to_daemon(timeout=5):
+                print(
+                    f'Can\'t connect to "{socket_name}": {client.socket.errorString()}',
+                    file=sys.stderr,
+                )
+                return 1
+            clients.append((name, client))
+        ui_instance = UI(settings, clients)
+        app.aboutToQuit.connect(ui_instance.when_about_to_quit)
+        for name, client in clients:
+            app.aboutToQuit.connect(client.when_about_to_quit)
+    else:
+        from instances import Instance_Manager
+
+        instances = Instance_Manager(settings)
+        ui_instance = UI(settings, instances.cores)
+        instances.sig_shutdown_requested.connect(app.quit)
+        app.aboutToQuit.connect(ui_instance.when_about_to_quit)
+        app.aboutToQuit.connect(instances.when_about_to_quit)
     ui_instance.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Minecraft server GUI")
+    parser.add_argument("--config", default=CONFIG_FILE)
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run the server and backups without a window, controlled through the local socket",
+    )
+    parser.add_argument(
+        "--attach",
+        nargs="?",
+        const="",
+        metavar="INSTANCE_OR_SOCKET",
+        help="open the window as a client of a running headless daemon, "
+        "attaching to every configured instance unless one instance or socket is named",
+    )
+    args = parser.parse_args()
+
+    settings = load_settings(os.path.abspath(args.config))
+    work_dir=os.path.abspath(settings["work_dir"])
+    os.chdir(work_dir)
+    if args.headless:
+        sys.exit(run_headless(settings))
+    sys.exit(run_ui(settings, args.attach))
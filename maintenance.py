@@ -0,0 +1,108 @@
+import os
+import re
+import subprocess
+import threading
+import psutil
+from utils import CREATE_NO_WINDOW, BELOW_NORMAL_PRIORITY_CLASS
+
+PROGRESS_PATTERN = re.compile(rb"(\d+)%")
+PRUNE_PENDING_FILE = "maintenance_prune_pending"
+
+
+class Repo_Maintenance:
+    def __init__(self, git_dir, threads=1, window_memory="256m", batch_size="2g"):
+        self.git_dir = git_dir
+        self.threads = threads
+        self.window_memory = window_memory
+        self.batch_size = batch_size
+        self.process = None
+        self.cancelled = threading.Event()
+        self.prune_pending_path = os.path.join(self.git_dir, PRUNE_PENDING_FILE)
+
+    def request_prune(self):
+        open(self.prune_pending_path, "w").close()
+
+    def is_prune_pending(self):
+        return os.path.exists(self.prune_pending_path)
+
+    def steps(self):
+        if self.is_prune_pending():
+            packing = [
+                (
+                    "Dropping pruned backups",
+                    ["repack", "-a", "-d", "--cruft", "--cruft-expiration=now", "--write-midx"],
+                ),
+                ("Removing loose objects", ["prune", "--expire=now"]),
+            ]
+        else:
+            packing = [("Packing loose objects", ["repack", "-d", "--geometric=2", "--write-midx"])]
+        return packing + [
+            ("Expiring unused packs", ["multi-pack-index", "expire", "--progress"]),
+            (
+                "Repacking small packs",
+                ["multi-pack-index", "repack", "--progress", f"--batch-size={self.batch_size}"],
+            ),
+            ("Writing commit-graph", ["commit-graph", "write", "--reachable", "--split", "--progress"]),
+        ]
+
+    def command(self, args):
+        return [
+            "git",
+            "--git-dir",
+            self.git_dir,
+            "-c",
+            f"pack.threads={self.threads}",
+            "-c",
+            f"pack.windowMemory={self.window_memory}",
+            "-c",
+            "gc.auto=0",
+            *args,
+        ]
+
+    def run(self, progress):
+        self.cancelled.clear()
+        pruning = self.is_prune_pending()
+        steps = self.steps()
+        for index, (name, args) in enumerate(steps):
+            if self.cancelled.is_set():
+                return False
+            progress(index, len(steps), name, None)
+            if not self.run_step(self.command(args), lambda percent: progress(index, len(steps), name, percent)):
+                return False
+        if pruning:
+            os.remove(self.prune_pending_path)
+        progress(len(steps), len(steps), "Done", None)
+        return True
+
+    def run_step(self, command, progress):
+        self.process = subprocess.Popen(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            creationflags=CREATE_NO_WINDOW | BELOW_NORMAL_PRIORITY_CLASS,
+        )
+        if os.name != "nt":
+            try:
+                psutil.Process(self.process.pid).nice(10)
+            except psutil.Error:
+                pass
+        last = -1
+        for chunk in iter(lambda: self.process.stderr.read1(4096), b""):
+            for match in PROGRESS_PATTERN.finditer(chunk):
+                percent = int(match.group(1))
+                if percent // 10 != last // 10:
+                    last = percent
+                    progress(percent)
+        returncode = self.process.wait()
+        self.process = None
+        if self.cancelled.is_set():
+            return False
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        return True
+
+    def cancel(self):
+        self.cancelled.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
@@ -0,0 +1,238 @@
+import re
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PyQt5.QtCore import QObject
+
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+LOG_LEVEL_PATTERN = re.compile(r"^\[[^\]]*\] \[[^\]]*/(\w+)\]:")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    def __init__(self, lock, name, kind, help, label_names=(), buckets=None):
+        self.lock = lock
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            key = self.key(labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def observe(self, value, **labels):
+        with self.lock:
+            key = self.key(labels)
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            counts = [c + 1 if value <= bound else c for c, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}")
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = format_labels(self.label_names, key, [("le", format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = format_labels(self.label_names, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Metrics_Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def add(self, name, kind, help, label_names=(), buckets=None):
+        metric = Metric(self.lock, name, kind, help, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, label_names=()):
+        return self.add(name, "counter", help, label_names)
+
+    def gauge(self, name, help, label_names=()):
+        return self.add(name, "gauge", help, label_names)
+
+    def histogram(self, name, help, label_names=(), buckets=DURATION_BUCKETS):
+        return self.add(name, "histogram", help, label_names, tuple(buckets))
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class Metrics_Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Metrics_Server:
+    def __init__(self, registry, address):
+        host, _, port = address.rpartition(":")
+        self.registry = registry
+        self.address = (host or "127.0.0.1", int(port))
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(self.address, Metrics_Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = self.registry
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.httpd != None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+class Metrics_Collector(QObject):
+    def __init__(self, core, registry):
+        super().__init__()
+        self.core = core
+        self.task_start_times = {}
+        self.server_up = registry.gauge("mcgui_server_up", "Whether the server process is running")
+        self.server_uptime = registry.gauge("mcgui_server_uptime_seconds", "Seconds since the server started")
+        self.server_starts = registry.counter("mcgui_server_starts_total", "Server process starts")
+        self.players = registry.gauge("mcgui_players_online", "Players online")
+        self.cpu = registry.gauge("mcgui_server_cpu_percent", "CPU usage of the server process tree")
+        self.memory = registry.gauge("mcgui_server_memory_bytes", "Resident memory of the server process tree")
+        self.threads = registry.gauge("mcgui_server_threads", "Threads in the server process tree")
+        self.open_files = registry.gauge("mcgui_server_open_files", "Open files in the server process tree")
+        self.disk_rate = registry.gauge(
+            "mcgui_server_disk_bytes_per_second", "Disk I/O rate of the server process tree", ("direction",)
+        )
+        self.mspt = registry.gauge("mcgui_server_mspt", "Average milliseconds per tick at the last tick query")
+        self.heap_max = registry.gauge("mcgui_server_heap_max_bytes", "JVM maximum heap size")
+        self.console_lines = registry.counter("mcgui_console_lines_total", "Lines printed by the server")
+        self.log_messages = registry.counter(
+            "mcgui_log_messages_total", "Messages logged by the GUI", ("level",)
+        )
+        self.queue_depth = registry.gauge("mcgui_task_queue_depth", "Background tasks waiting to run")
+        self.tasks = registry.counter("mcgui_tasks_total", "Finished background tasks", ("kind", "state"))
+        self.task_duration = registry.histogram(
+            "mcgui_task_duration_seconds", "Duration of background tasks", ("kind",)
+        )
+        self.backup_bytes = registry.counter("mcgui_backup_written_bytes_total", "Bytes stored by backups")
+        self.backup_size = registry.gauge("mcgui_backup_world_bytes", "World size at the last backup")
+        self.backup_changed = registry.gauge("mcgui_backup_changed_files", "Files changed in the last backup")
+        self.last_backup = registry.gauge(
+            "mcgui_last_backup_timestamp_seconds", "Unix time of the last successful backup"
+        )
+
+        server = core.server
+        scheduler = core.scheduler
+        server.started.connect(self.when_server_started)
+        server.sig_info_updated.connect(self.when_server_info_updated)
+        server.sig_server_lines.connect(self.when_server_lines)
+        core.sig_out.connect(self.when_log_message)
+        server.sig_out.connect(self.when_log_message)
+        core.backup_manager.sig_out.connect(self.when_log_message)
+        scheduler.sig_task_started.connect(self.when_task_started)
+        scheduler.sig_task_done.connect(self.when_task_done)
+        self.when_server_info_updated()
+
+    def when_server_started(self):
+        self.server_starts.inc()
+
+    def when_server_info_updated(self):
+        server = self.core.server
+        usage = server.resource_usage
+        self.server_up.set(1 if server.is_running else 0)
+        self.queue_depth.set(len(self.core.scheduler.queued_tasks()))
+        self.players.set(server.player_count if server.is_running else 0)
+        if server.start_time != None:
+            self.server_uptime.set(round((time.time() - server.start_time.timestamp()), 1))
+        else:
+            self.server_uptime.set(0)
+        if server.mspt != None:
+            self.mspt.set(server.mspt)
+        if usage == None:
+            return
+        self.cpu.set(usage["cpu"])
+        self.memory.set(usage["memory"])
+        self.threads.set(usage["threads"])
+        self.open_files.set(usage["open_files"])
+        self.disk_rate.set(usage["read_rate"], direction="read")
+        self.disk_rate.set(usage["write_rate"], direction="write")
+        if usage["heap_max"] != None:
+            self.heap_max.set(usage["heap_max"])
+
+    def when_server_lines(self, lines):
+        self.console_lines.inc(len(lines))
+
+    def when_log_message(self, line):
+        match = LOG_LEVEL_PATTERN.match(line)
+        if match:
+            self.log_messages.inc(level=match.group(1))
+
+    def when_task_started(self, task):
+        self.task_start_times[task.id] = time.monotonic()
+        self.queue_depth.set(len(self.core.scheduler.queued_tasks()))
+
+    def when_task_done(self, task):
+        self.queue_depth.set(len(self.core.scheduler.queued_tasks()))
+        self.tasks.inc(kind=task.kind, state=task.state)
+        start_time = self.task_start_times.pop(task.id, None)
+        if start_time != None:
+            self.task_duration.observe(time.monotonic() - start_time, kind=task.kind)
+        result = task.result
+        if task.state == "done" and isinstance(result, dict) and "commit" in result:
+            self.backup_bytes.inc(result.get("bytes", 0))
+            self.backup_size.set(result["size"])
+            if "changed" in result:
+                self.backup_changed.set(result["changed"])
+            self.last_backup.set(int(time.time()))
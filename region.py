@@ -0,0 +1,112 @@
+import json
+
+SECTOR_SIZE = 4096
+HEADER_SIZE = 2 * SECTOR_SIZE
+CHUNK_COUNT = 1024
+CHUNKS_SUFFIX = ".mcgui-chunks"
+
+
+def is_region_file(path):
+    return path.endswith(".mca")
+
+
+def chunk_location(header, index):
+    offset = int.from_bytes(header[index * 4 : index * 4 + 3], "big")
+    count = header[index * 4 + 3]
+    return offset, count
+
+
+def split_region(data):
+    size = len(data)
+    if size < HEADER_SIZE:
+        return None
+    parts = {
+        "layout": json.dumps({"size": size}).encode(),
+        "header": data[:HEADER_SIZE],
+    }
+    spans = []
+    for index in range(CHUNK_COUNT):
+        offset, count = chunk_location(data, index)
+        if offset == 0 and count == 0:
+            continue
+        start = offset * SECTOR_SIZE
+        end = min(start + count * SECTOR_SIZE, size)
+        if offset < 2 or count == 0 or start >= size:
+            return None
+        length = int.from_bytes(data[start : start + 4], "big")
+        chunk_end = start + 4 + length
+        if length == 0 or chunk_end > end:
+            chunk_end = end
+        parts[f"c.{index}"] = data[start:chunk_end]
+        if data[chunk_end:end].strip(b"\0"):
+            parts[f"c.{index}.pad"] = data[chunk_end:end]
+        spans.append((start, end))
+
+    spans.sort()
+    position = HEADER_SIZE
+    for start, end in spans + [(size, size)]:
+        if start < position:
+            return None
+        if data[position:start].strip(b"\0"):
+            parts[f"gap.{position}"] = data[position:start]
+        position = end
+    return parts
+
+
+def assemble_region(parts):
+    size = json.loads(parts["layout"])["size"]
+    header = parts["header"]
+    buffer = bytearray(size)
+    buffer[:HEADER_SIZE] = header
+    for index in range(CHUNK_COUNT):
+        chunk = parts.get(f"c.{index}")
+        if chunk is None:
+            continue
+        start = chunk_location(header, index)[0] * SECTOR_SIZE
+        buffer[start : start + len(chunk)] = chunk
+        pad = parts.get(f"c.{index}.pad")
+        if pad is not None:
+            pad_start = start + len(chunk)
+            buffer[pad_start : pad_start + len(pad)] = pad
+    for name, gap in parts.items():
+        if name.startswith("gap."):
+            start = int(name[4:])
+            buffer[start : start + len(gap)] = gap
+    return bytes(buffer)
+
+
+def read_chunks(data):
+    chunks = {}
+    if data is None or len(data) < HEADER_SIZE:
+        return chunks
+    for index in range(CHUNK_COUNT):
+        offset, count = chunk_location(data, index)
+        if offset < 2 or count == 0:
+            continue
+        start = offset * SECTOR_SIZE
+        length = int.from_bytes(data[start : start + 4], "big")
+        if length == 0 or start + 4 + length > len(data):
+            continue
+        timestamp = data[SECTOR_SIZE + index * 4 : SECTOR_SIZE + index * 4 + 4]
+        chunks[index] = (data[start : start + 4 + length], timestamp)
+    return chunks
+
+
+def build_region(chunks):
+    header = bytearray(HEADER_SIZE)
+    body = bytearray()
+    sector = 2
+    for index in sorted(chunks):
+        payload, timestamp = chunks[index]
+        count = (len(payload) + SECTOR_SIZE - 1) // SECTOR_SIZE
+        header[index * 4 : index * 4 + 3] = sector.to_bytes(3, "big")
+        header[index * 4 + 3] = count
+        header[SECTOR_SIZE + index * 4 : SECTOR_SIZE + index * 4 + 4] = timestamp
+        body += payload
+        body += bytes(count * SECTOR_SIZE - len(payload))
+        sector += count
+    return bytes(header + body)
+
+
+def is_external_chunk(payload):
+    return len(payload) > 4 and payload[4] & 0x80 != 0
@@ -0,0 +1,41 @@
+import time
+
+PERIODS = {
+    "hourly": 3600,
+    "daily": 86400,
+    "weekly": 604800,
+    "monthly": 2592000,
+}
+
+
+class Retention_Policy:
+    def __init__(self, rules):
+        rules = rules or {}
+        self.enabled = rules.get("enabled", True)
+        self.keep_all = rules.get("keep_all", 0)
+        self.tiers = [(PERIODS[name], rules[name]) for name in PERIODS if name in rules]
+
+    def is_enabled(self):
+        return self.enabled and (self.keep_all > 0 or len(self.tiers) > 0)
+
+    def bucket(self, timestamp, period):
+        return (timestamp + time.localtime(timestamp).tm_gmtoff) // period
+
+    def select(self, backups, now):
+        keep = set()
+        for period, limit in self.tiers:
+            buckets = set()
+            for backup in sorted(backups, key=lambda backup: backup["timestamp"], reverse=True):
+                if limit != None and now - backup["timestamp"] > limit:
+                    continue
+                bucket = self.bucket(backup["timestamp"], period)
+                if bucket not in buckets:
+                    buckets.add(bucket)
+                    keep.add(backup["hash"])
+        return [
+            backup
+            for backup in backups
+            if backup["tag"] == None
+            and backup["hash"] not in keep
+            and now - backup["timestamp"] > self.keep_all
+        ]
@@ -0,0 +1,178 @@
+import re
+import time
+import psutil
+
+HISTORY_TIERS = [(1, 600), (60, 1440), (3600, 720)]
+METRICS = (
+    "cpu",
+    "memory",
+    "virtual_memory",
+    "threads",
+    "open_files",
+    "read_rate",
+    "write_rate",
+    "processes",
+)
+TREE_REFRESH_INTERVAL = 5
+STARTUP_PERIOD = 60
+HEAP_PATTERN = re.compile(r"^-Xmx(\d+)([kKmMgGtT]?)$")
+HEAP_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+class Ring_Buffer:
+    def __init__(self, capacity):
+        self.items = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, item):
+        capacity = len(self.items)
+        self.items[(self.start + self.size) % capacity] = item
+        if self.size < capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % capacity
+
+    def values(self):
+        capacity = len(self.items)
+        return [self.items[(self.start + i) % capacity] for i in range(self.size)]
+
+
+class Resource_History:
+    def __init__(self, tiers=HISTORY_TIERS):
+        self.tiers = [[resolution, Ring_Buffer(capacity), None, None, 0] for resolution, capacity in tiers]
+
+    def add(self, timestamp, values):
+        for tier in self.tiers:
+            resolution, buffer, bucket, sums, count = tier
+            current = int(timestamp // resolution)
+            if bucket != None and bucket != current and count > 0:
+                buffer.append((bucket * resolution, tuple(total / count for total in sums)))
+                sums, count = None, 0
+            if sums == None:
+                sums = [0.0] * len(values)
+            tier[2] = current
+            tier[3] = [total + value for total, value in zip(sums, values)]
+            tier[4] = count + 1
+
+    def resolutions(self):
+        return [tier[0] for tier in self.tiers]
+
+    def series(self, resolution, metric=None):
+        for tier in self.tiers:
+            if tier[0] == resolution:
+                samples = tier[1].values()
+                if metric == None:
+                    return [(timestamp, dict(zip(METRICS, values))) for timestamp, values in samples]
+                index = METRICS.index(metric)
+                return [(timestamp, values[index]) for timestamp, values in samples]
+        raise KeyError(f"No history with a resolution of {resolution}s")
+
+
+def heap_max(process):
+    for argument in process.cmdline():
+        match = HEAP_PATTERN.match(argument)
+        if match:
+            return int(match.group(1)) * HEAP_UNITS[match.group(2).lower()]
+    return None
+
+
+class Resource_Sampler:
+    def __init__(self):
+        self.root = None
+        self.processes = {}
+        self.attach_time = 0
+        self.last_refresh = 0
+        self.last_io = None
+        self.heap_max = None
+        self.latest = None
+        self.history = Resource_History()
+
+    def attach(self, pid):
+        try:
+            self.root = psutil.Process(pid)
+        except psutil.Error:
+            self.root = None
+        self.processes = {} if self.root == None else {pid: self.root}
+        self.attach_time = time.time()
+        self.last_refresh = 0
+        self.last_io = None
+        self.heap_max = None
+        self.latest = None
+
+    def detach(self):
+        self.root = None
+        self.processes = {}
+        self.last_io = None
+        self.latest = None
+
+    def refresh_tree(self):
+        try:
+            children = self.root.children(recursive=True)
+        except psutil.Error:
+            children = []
+        processes = {self.root.pid: self.root}
+        for process in children:
+            cached = self.processes.get(process.pid)
+            processes[process.pid] = cached if cached != None and cached == process else process
+        self.processes = processes
+        if self.heap_max == None:
+            for process in processes.values():
+                try:
+                    self.heap_max = heap_max(process)
+                except psutil.Error:
+                    continue
+                if self.heap_max != None:
+                    break
+
+    def sample(self, timestamp=None):
+        if self.root == None:
+            return None
+        if timestamp == None:
+            timestamp = time.time()
+        starting = len(self.processes) == 1 and timestamp - self.attach_time < STARTUP_PERIOD
+        if starting or timestamp - self.last_refresh >= TREE_REFRESH_INTERVAL:
+            self.last_refresh = timestamp
+            self.refresh_tree()
+
+        sample = dict.fromkeys(METRICS, 0.0)
+        io_counters = {}
+        for pid, process in list(self.processes.items()):
+            try:
+                with process.oneshot():
+                    sample["cpu"] += process.cpu_percent(interval=None)
+                    memory = process.memory_info()
+                    sample["memory"] += memory.rss
+                    sample["virtual_memory"] += memory.vms
+                    sample["threads"] += process.num_threads()
+                    if hasattr(process, "num_fds"):
+                        sample["open_files"] += process.num_fds()
+                    else:
+                        sample["open_files"] += process.num_handles()
+                    if hasattr(process, "io_counters"):
+                        io = process.io_counters()
+                        io_counters[pid] = (io.read_bytes, io.write_bytes)
+                    sample["processes"] += 1
+            except psutil.NoSuchProcess:
+                del self.processes[pid]
+            except psutil.AccessDenied:
+                continue
+        if self.root.pid not in self.processes:
+            self.root = None
+            return None
+
+        if self.last_io != None:
+            last_timestamp, last_counters = self.last_io
+            elapsed = max(timestamp - last_timestamp, 1e-3)
+            for pid, (read_bytes, write_bytes) in io_counters.items():
+                if pid in last_counters:
+                    sample["read_rate"] += max(read_bytes - last_counters[pid][0], 0) / elapsed
+                    sample["write_rate"] += max(write_bytes - last_counters[pid][1], 0) / elapsed
+        self.last_io = (timestamp, io_counters)
+        self.history.add(timestamp, [sample[metric] for metric in METRICS])
+        sample["heap_max"] = self.heap_max
+        self.latest = sample
+        return sample
@@ -0,0 +1,247 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+from PyQt5.QtCore import pyqtSignal, QObject, QTimer
+
+PRIORITY_RESTORE = 0
+PRIORITY_TAGGED_BACKUP = 1
+PRIORITY_AUTO_BACKUP = 2
+PRIORITY_MAINTENANCE = 3
+
+task_ids = itertools.count(1)
+
+
+class Task:
+    def __init__(
+        self,
+        name,
+        priority,
+        f,
+        args=(),
+        kind=None,
+        key=None,
+        prepare=None,
+        finish=None,
+        cancel=None,
+        preemptible=False,
+        limited=False,
+    ):
+        self.id = next(task_ids)
+        self.name = name
+        self.kind = kind or name
+        self.priority = priority
+        self.f = f
+        self.args = args
+        self.key = key
+        self.prepare = prepare
+        self.finish = finish
+        self.cancel = cancel
+        self.preemptible = preemptible
+        self.limited = limited
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.cancelled = threading.Event()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+
+class Task_Limiter(QObject):
+    def __init__(self, max_concurrent=1, stagger=0):
+        super().__init__()
+        self.max_concurrent = max_concurrent
+        self.stagger = stagger
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.running = 0
+        self.last_start = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.dispatch)
+
+    def acquire(self, priority, callback):
+        request = [priority, next(self.sequence), callback]
+        heapq.heappush(self.waiting, request)
+        QTimer.singleShot(0, self.dispatch)
+        return request
+
+    def withdraw(self, request):
+        request[2] = None
+
+    def release(self):
+        self.running -= 1
+        self.dispatch()
+
+    def dispatch(self):
+        while self.waiting and self.running < self.max_concurrent:
+            if self.waiting[0][2] == None:
+                heapq.heappop(self.waiting)
+                continue
+            now = time.monotonic()
+            if self.last_start != None and now - self.last_start < self.stagger:
+                if not self.timer.isActive():
+                    self.timer.start(int((self.stagger - (now - self.last_start)) * 1000) + 1)
+                return
+            callback = heapq.heappop(self.waiting)[2]
+            self.running += 1
+            self.last_start = now
+            callback()
+
+
+class Task_Scheduler(QObject):
+    sig_task_started = pyqtSignal(object)
+    sig_task_progress = pyqtSignal(object, int, int, str, int)
+    sig_task_done = pyqtSignal(object)
+    sig_task_finished = pyqtSignal(object)
+
+    def __init__(self, limiter=None):
+        super().__init__()
+        self.limiter = limiter
+        self.slot_request = None
+        self.holding_slot = False
+        self.queue = []
+        self.sequence = itertools.count()
+        self.current = None
+        self.jobs = queue.Queue()
+        self.worker = None
+        self.sig_task_finished.connect(self.when_task_finished)
+
+    def submit(self, task):
+        if task.key != None:
+            for queued in self.queued_tasks():
+                if queued.key == task.key:
+                    return queued
+        heapq.heappush(self.queue, (task.priority, next(self.sequence), task))
+        current = self.current
+        if current != None and current.preemptible and task.priority < current.priority:
+            self.cancel(current)
+        self.schedule_next()
+        return task
+
+    def queued_tasks(self):
+        return [task for _, _, task in sorted(self.queue) if task.state == "queued"]
+
+    def tasks(self):
+        tasks = self.queued_tasks()
+        if self.current != None:
+            tasks.insert(0, self.current)
+        return tasks
+
+    def find(self, task_id):
+        for task in self.tasks():
+            if task.id == task_id:
+                return task
+        return None
+
+    def is_busy(self):
+        return self.current != None
+
+    def schedule_next(self):
+        while self.current == None and self.queue:
+            task = heapq.heappop(self.queue)[2]
+            if task.state != "queued":
+                continue
+            self.current = task
+            if self.limiter == None or not task.limited:
+                self.start(task)
+            else:
+                task.state = "waiting"
+                self.slot_request = self.limiter.acquire(
+                    task.priority, lambda: self.when_slot_acquired(task)
+                )
+
+    def when_slot_acquired(self, task):
+        if task is not self.current or task.state != "waiting":
+            self.limiter.release()
+            return
+        self.slot_request = None
+        self.holding_slot = True
+        self.start(task)
+
+    def start(self, task):
+        task.state = "preparing"
+        self.sig_task_started.emit(task)
+        if task.prepare == None:
+            self.when_prepared(task, True)
+        else:
+            task.prepare(task, lambda ready=True: self.when_prepared(task, ready))
+
+    def when_prepared(self, task, ready):
+        if task is not self.current or task.state != "preparing":
+            return
+        if not ready or task.is_cancelled():
+            task.state = "cancelled"
+            self.when_task_finished(task)
+            return
+        task.state = "running"
+        if self.worker == None:
+            self.worker = threading.Thread(target=self.work)
+            self.worker.start()
+        self.jobs.put(task)
+
+    def work(self):
+        while True:
+            task = self.jobs.get()
+            if task == None:
+                return
+            try:
+                task.result = task.f(*task.args)
+                task.state = "cancelled" if task.is_cancelled() else "done"
+            except Exception as e:
+                task.error = e
+                task.state = "failed"
+            self.sig_task_finished.emit(task)
+
+    def when_task_finished(self, task):
+        if task is not self.current:
+            return
+        if task.finish != None:
+            task.finish(task)
+        self.current = None
+        if self.holding_slot:
+            self.holding_slot = False
+            self.limiter.release()
+        self.sig_task_done.emit(task)
+        self.schedule_next()
+
+    def progress(self, step, total, name, percent=-1):
+        task = self.current
+        if task != None:
+            self.sig_task_progress.emit(task, step, total, name, percent)
+
+    def cancel(self, task):
+        if task.state == "queued":
+            task.cancelled.set()
+            task.state = "cancelled"
+            self.sig_task_done.emit(task)
+            return True
+        if task.state == "waiting":
+            task.cancelled.set()
+            task.state = "cancelled"
+            self.limiter.withdraw(self.slot_request)
+            self.slot_request = None
+            self.current = None
+            self.sig_task_done.emit(task)
+            self.schedule_next()
+            return True
+        if task.state == "preparing":
+            task.cancelled.set()
+            return True
+        if task.state == "running" and task.cancel != None:
+            task.cancelled.set()
+            task.cancel()
+            return True
+        return False
+
+    def shutdown(self, timeout=None):
+        for task in self.queued_tasks():
+            self.cancel(task)
+        task = self.current
+        if task != None and (task.preemptible or task.state == "waiting"):
+            self.cancel(task)
+        if self.worker != None:
+            self.jobs.put(None)
+            self.worker.join(timeout)
@@ -1,44 +1,71 @@
 import datetime
-import psutil
+import os
+import re
 from PyQt5.QtCore import QProcess, pyqtSignal
+from sampler import Resource_Sampler
 
 from utils import (
-    Wait_for_a_Specific_Output,
     Listener_for_Specific_Output,
-    Wait_for_a_Signal
+    Line_Framer,
+    Output_Dispatcher,
+    Output_Request,
+    Signal_Request
     )
 
 ROLE="Server Manager"
 
 class Server_Manager(QProcess):
     sig_out = pyqtSignal(str)
-    sig_server_out = pyqtSignal(str)
+    sig_server_lines = pyqtSignal(list)
     sig_info_updated=pyqtSignal()
 
     def __init__(self, settings):
         super().__init__()
+        self.output_dispatcher = Output_Dispatcher()
         self.player_joined_listener = Listener_for_Specific_Output(
-            self.sig_server_out, lambda x: "joined the game" in x
+            self.output_dispatcher, "joined the game"
         )
         self.player_left_listener = Listener_for_Specific_Output(
-            self.sig_server_out, lambda x: "left the game" in x
+            self.output_dispatcher, "left the game"
+        )
+
+        self.server_out_framer = Line_Framer(
+            settings.get("server_output_encoding", "utf-8")
         )
 
         self.timestamp_format = settings.get("timestamp_format", "%H:%M:%S")
+        self.request_timeout = settings.get("server_request_timeout", 60)
+        self.stop_timeout = settings.get("server_stop_timeout", 120)
+        self.tick_query_command = settings.get("tick_query_command", "tick query")
+        self.tick_query_pattern = settings.get(
+            "tick_query_pattern", r"Average time per tick: ([\d.]+) ?ms"
+        )
+        try:
+            re.compile(self.tick_query_pattern)
+        except re.error as e:
+            raise ValueError(f'Option "tick_query_pattern" is not a valid regex: {str(e)}')
+        self.tick_query_timeout = settings.get("tick_query_timeout", 5)
         self.start_command = settings.get("start_command")
         if self.start_command == None:
             raise KeyError(
                 'Can\'t find option "start_command". Please add it in config.json'
             )
+        self.work_dir = settings.get("work_dir")
         self.is_running = False
         self.player_count = 0
         self.start_time = None
         self.cpu_usage = None
         self.memory_usage = None
+        self.resource_usage = None
+        self.resource_sampler = Resource_Sampler()
+        self.mspt = None
 
         self.setProcessChannelMode(QProcess.MergedChannels)
+        if self.work_dir != None:
+            self.setWorkingDirectory(os.path.abspath(self.work_dir))
 
         self.readyReadStandardOutput.connect(self.server_out)
+        self.sig_server_lines.connect(self.output_dispatcher.dispatch)
         self.started.connect(self.when_server_started)
         self.finished.connect(self.when_server_finished)
         self.player_joined_listener.sig.connect(self.when_player_joined)
@@ -51,6 +78,7 @@ class Server_Manager(QProcess):
 
         self.shell_out(ROLE, "INFO", "Starting server...")
 
+        self.server_out_framer.reset()
         self.start(self.start_command)
 
     def stop_server(self):
@@ -61,11 +89,28 @@ class Server_Manager(QProcess):
         else:
             self.shell_out(ROLE, "WARN", "Server is not running.")
 
-    def stop_server_and_wait_to_stopped(self):
-        if self.is_running:
-            block = Wait_for_a_Signal(self.finished)
+    def stop_server_async(self, callback, timeout=None):
+        if timeout is None:
+            timeout = self.stop_timeout
+        request = Signal_Request(
+            self,
+            self.finished,
+            lambda result: self.when_stop_requested(result, callback),
+            timeout,
+        )
+        if self.state() == QProcess.NotRunning:
+            request.finish_soon(True)
+        else:
             self.stop_server()
-            block.loop.exec()
+        return request
+
+    def when_stop_requested(self, result, callback):
+        if result is None and self.state() != QProcess.NotRunning:
+            self.shell_out(ROLE, "WARN", "Server did not stop in time, killing it.")
+            self.kill()
+            self.waitForFinished(5000)
+        if callback is not None:
+            callback(result)
 
     def shell_out(self, role, flag, line):
         current_time = datetime.datetime.now().strftime(
@@ -83,28 +128,67 @@ class Server_Manager(QProcess):
         if self.state() == QProcess.Running:
             self.write(f"{command}\n".encode())
 
-    def server_exec_and_get_output(self,command,filter):
-        block=Wait_for_a_Specific_Output(self.sig_server_out,filter)
-        self.server_exec(command)
-        block.loop.exec()
-        return block.result
+    def request(self, command, pattern, callback, timeout=None, regex=False):
+        if timeout is None:
+            timeout = self.request_timeout
+        request = Output_Request(
+            self, self.output_dispatcher, pattern, regex, callback, timeout
+        )
+        if self.state() == QProcess.Running:
+            self.write(f"{command}\n".encode())
+        else:
+            self.shell_out(ROLE, "WARN", "Server is not running.")
+            request.finish_soon()
+        return request
+
+    def query_tick_health(self, callback):
+        if self.state() != QProcess.Running:
+            callback(None)
+            return
+        self.request(
+            self.tick_query_command,
+            self.tick_query_pattern,
+            lambda line: self.when_tick_health_queried(line, callback),
+            self.tick_query_timeout,
+            regex=True,
+        )
+
+    def when_tick_health_queried(self, line, callback):
+        match = None if line is None else re.search(self.tick_query_pattern, line)
+        self.mspt = float(match.group(1)) if match else None
+        callback(self.mspt)
 
     def server_out(self):
-        output = self.readAllStandardOutput().data().decode("utf-8", errors="replace")
-        self.sig_server_out.emit(output)
+        lines = self.server_out_framer.feed(self.readAllStandardOutput().data())
+        self.emit_server_lines(lines)
+
+    def flush_server_out(self):
+        lines = self.server_out_framer.feed(self.readAllStandardOutput().data())
+        lines += self.server_out_framer.flush()
+        self.emit_server_lines(lines)
+
+    def emit_server_lines(self, lines):
+        if not lines:
+            return
+        self.sig_server_lines.emit(lines)
 
     def when_server_started(self):
         self.start_time = datetime.datetime.now()
         self.player_count = 0
         self.is_running = True
+        self.resource_sampler.attach(self.processId())
         self.player_joined_listener.start()
         self.player_left_listener.start()
 
     def when_server_finished(self):
+        self.flush_server_out()
         self.is_running = False
         self.start_time = None
         self.cpu_usage = None
         self.memory_usage = None
+        self.resource_usage = None
+        self.resource_sampler.detach()
+        self.mspt = None
         self.player_joined_listener.stop()
         self.player_left_listener.stop()
         self.update_server_info()
@@ -118,18 +202,29 @@ class Server_Manager(QProcess):
     def when_about_to_quit(self):
         self.player_joined_listener.stop()
         self.player_left_listener.stop()
-        self.stop_server_and_wait_to_stopped()
-
-        self.readyReadStandardOutput.disconnect()
-        self.started.disconnect()
-        self.finished.disconnect()
-        self.sig_out.disconnect()
-        self.sig_info_updated.disconnect()
-        self.sig_server_out.disconnect()
+        if self.state() != QProcess.NotRunning:
+            self.stop_server()
+            if not self.waitForFinished(self.stop_timeout * 1000):
+                self.kill()
+                self.waitForFinished(5000)
+
+        for signal in (
+            self.readyReadStandardOutput,
+            self.started,
+            self.finished,
+            self.sig_out,
+            self.sig_info_updated,
+            self.sig_server_lines,
+        ):
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass
 
     def update_server_info(self):
         if self.is_running:
-            process = psutil.Process(self.processId())
-            self.cpu_usage = process.cpu_percent(interval=None)
-            self.memory_usage = process.memory_info().rss / (1024 * 1024)
+            self.resource_usage = self.resource_sampler.sample()
+            if self.resource_usage != None:
+                self.cpu_usage = self.resource_usage["cpu"]
+                self.memory_usage = self.resource_usage["memory"] / (1024 * 1024)
         self.sig_info_updated.emit()
@@ -0,0 +1,95 @@
+import os
+import json
+import shutil
+import sys
+
+FICLONE = 0x40049409
+MANIFEST_FILE = "manifest.json"
+
+
+class World_Snapshot:
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+        self.current_dir = os.path.join(self.snapshot_dir, "current")
+        self.next_dir = os.path.join(self.snapshot_dir, "next")
+        self.old_dir = os.path.join(self.snapshot_dir, "old")
+        self.manifest_path = os.path.join(self.snapshot_dir, MANIFEST_FILE)
+        self.reflink_supported = sys.platform.startswith("linux")
+        self.hardlink_supported = True
+
+    def load_manifest(self):
+        if not os.path.isdir(self.current_dir):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, files):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(files, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def take(self, src_dir, files):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        previous = self.load_manifest()
+        for path in (self.next_dir, self.old_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(self.next_dir)
+
+        manifest = {}
+        stats = {"linked": 0, "cloned": 0, "copied": 0}
+        for path, (mtime, size, mode) in files.items():
+            parts = path.split("/")
+            src_path = os.path.join(src_dir, *parts)
+            dst_path = os.path.join(self.next_dir, *parts)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            entry = previous.get(path)
+            if entry is not None and entry[0] == mtime and entry[1] == size:
+                if self.link(os.path.join(self.current_dir, *parts), dst_path):
+                    manifest[path] = entry
+                    stats["linked"] += 1
+                    continue
+            try:
+                stats[self.copy(src_path, dst_path)] += 1
+                shutil.copymode(src_path, dst_path)
+                os.utime(dst_path, ns=(mtime, mtime))
+            except FileNotFoundError:
+                continue
+            manifest[path] = [mtime, size]
+
+        if os.path.exists(self.current_dir):
+            os.rename(self.current_dir, self.old_dir)
+        os.rename(self.next_dir, self.current_dir)
+        self.save_manifest(manifest)
+        if os.path.exists(self.old_dir):
+            shutil.rmtree(self.old_dir)
+        return stats
+
+    def link(self, src_path, dst_path):
+        if not self.hardlink_supported:
+            return False
+        try:
+            os.link(src_path, dst_path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError:
+            self.hardlink_supported = False
+            return False
+
+    def copy(self, src_path, dst_path):
+        if self.reflink_supported:
+            import fcntl
+
+            with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                    return "cloned"
+                except OSError:
+                    self.reflink_supported = False
+        shutil.copyfile(src_path, dst_path)
+        return "copied"
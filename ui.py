@@ -6,7 +6,6 @@ from PyQt5.QtWidgets import (
     QApplication,
     QWidget,
     QVBoxLayout,
-    QTextEdit,
     QLineEdit,
     QPushButton,
     QHBoxLayout,
@@ -14,68 +13,66 @@ from PyQt5.QtWidgets import (
     QMenu,
     QAction,
     QLabel,
+    QTabWidget,
 )
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5 import QtGui
-from core import Core
+from console import Console, Console_Formatter
+from log_archive import parse_search_text
 
 ROLE="UI"
 USER_ROLE="User"
 
-class UI(QWidget):
+class Instance_Panel(QWidget):
     sig_out=pyqtSignal(str)
-    def __init__(self,settings):
+    def __init__(self,settings,core,formatter,name=None):
         super().__init__()
 
         self.timestamp_format=settings.get('timestamp_format', '%H:%M:%S')
-        self.stylesheet_path=settings.get('stylesheet', 'styles/MacOS.qss')
-        self.ui_font=settings.get('font', 'Arial')
-        self.ui_font_size=settings.get('font_size', 12)
-        self.tray_icon_path=settings.get('tray_icon', 'res/minecraft_icon.ico')
-        self.window_icon_path=settings.get('window_icon', 'res/minecraft_icon.ico')
-        self.colormap=settings.get('cmdl_colormap', {})
-        self.output_exclude=settings.get('cmdl_output_exclude', [])
-
-        self.core=Core(settings)
+        self.scrollback=settings.get('cmdl_scrollback', 5000)
+        self.flush_interval=settings.get('cmdl_flush_interval', 16)
+        self.log_search_limit=settings.get('log_search_limit', 500)
+        self.formatter=formatter
+        self.name=name
+        self.core=core
 
         self.init_ui()
-        self.init_tray_icon()
 
         self.sig_out.connect(self.cmdl_output_catcher)
         self.core.sig_out.connect(self.cmdl_output_catcher)
-        self.core.server.sig_server_out.connect(self.cmdl_output_catcher)
+        self.core.server.sig_server_lines.connect(self.cmdl_lines_catcher)
         self.core.server.sig_out.connect(self.cmdl_output_catcher)
         self.core.backup_manager.sig_out.connect(self.cmdl_output_catcher)
         self.core.server.sig_info_updated.connect(self.when_server_info_updated)
-
-        self.core.sig_out.connect(self.ingame_output_catcher)
-        self.core.server.sig_out.connect(self.ingame_output_catcher)
-        self.core.backup_manager.sig_out.connect(self.ingame_output_catcher)
+        self.core.scheduler.sig_task_started.connect(self.when_task_started)
+        self.core.scheduler.sig_task_progress.connect(self.when_task_progress)
+        self.core.scheduler.sig_task_done.connect(self.when_task_done)
+        if self.core.log_archive != None:
+            self.sig_out.connect(self.core.log_archive.append)
 
     def init_ui(self):
-        with open(self.stylesheet_path, encoding="utf-8") as f:
-            qss_str = f.read()
-        self.setStyleSheet(qss_str)
-        font = QtGui.QFont(
-            self.ui_font, self.ui_font_size, italic=True
-        )
-        QApplication.instance().setFont(font)
-
         layout = QVBoxLayout()
         button_layout = QHBoxLayout()
-        self.cmdl = QTextEdit(self)
+        self.cmdl = Console(self, self.scrollback, self.flush_interval)
         self.server_info_label = QLabel(self)
+        self.task_label = QLabel(self)
         self.cmdl_input = QLineEdit(self)
+        self.log_search_input = QLineEdit(self)
+        self.log_search_results = Console(None, self.log_search_limit, self.flush_interval)
         self.start_button = QPushButton("Start Server", self)
         self.stop_button = QPushButton("Stop Server", self)
         self.clear_button = QPushButton("Clear Output", self)
 
         self.cmdl_input.setPlaceholderText("Enter command")
-        self.cmdl.setReadOnly(True)
         self.server_info_label.setWordWrap(True)
         self.server_info_label.setText("Server is not running")
+        self.task_label.setVisible(False)
+        self.log_search_input.setPlaceholderText("Search logs, e.g. Steve joined since:2d until:2026-10-01")
+        self.log_search_results.setWindowTitle("Log Search")
+        self.log_search_results.setGeometry(150, 150, 1000, 600)
 
         self.cmdl_input.returnPressed.connect(self.when_cmdl_input_returnPressed)
+        self.log_search_input.returnPressed.connect(self.when_log_search_input_returnPressed)
         self.start_button.clicked.connect(self.core.start_server)
         self.stop_button.clicked.connect(self.core.stop_server)
         self.clear_button.clicked.connect(self.cmdl.clear)
@@ -85,8 +82,146 @@ class UI(QWidget):
         button_layout.addWidget(self.clear_button)
         layout.addWidget(self.cmdl)
         layout.addWidget(self.server_info_label)
+        layout.addWidget(self.task_label)
         layout.addWidget(self.cmdl_input)
+        layout.addWidget(self.log_search_input)
         layout.addLayout(button_layout)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.setLayout(layout)
+
+    def when_server_info_updated(self):
+        usage = self.core.server.resource_usage
+        if self.core.server.is_running and usage != None:
+            run_time = datetime.datetime.now() - self.core.server.start_time
+            run_time_str = str(run_time).split(".")[0]
+            self.server_info_label.setText(
+                f"Server Uptime: {run_time_str}\n"
+                f"CPU Usage: {self.core.server.cpu_usage:.2f}%\n"
+                f"Memory Usage: {self.core.server.memory_usage:.2f} MB\n"
+                f"Threads: {int(usage['threads'])}  Open Files: {int(usage['open_files'])}\n"
+                f"Disk I/O: {usage['read_rate'] / (1024 * 1024):.2f} MB/s read, "
+                f"{usage['write_rate'] / (1024 * 1024):.2f} MB/s written\n"
+                f"Players Online: {self.core.server.player_count}"
+            )
+        elif self.core.server.is_running:
+            self.server_info_label.setText("Server is starting")
+        else:
+            self.server_info_label.setText("Server is not running")
+
+    def when_task_started(self, task):
+        self.task_label.setText(f"{task.name}...")
+        self.task_label.setVisible(True)
+
+    def when_task_progress(self, task, step, total, name, percent):
+        text = f"{task.name}: {name} ({min(step + 1, total)}/{total})"
+        if percent >= 0:
+            text += f" {percent}%"
+        self.task_label.setText(text)
+        self.task_label.setVisible(True)
+
+    def when_task_done(self, task):
+        if not self.core.scheduler.is_busy():
+            self.task_label.setVisible(False)
+
+    def when_cmdl_input_returnPressed(self):
+        command = self.cmdl_input.text()
+        self.cmdl_input.clear()
+        self.out(USER_ROLE, "INFO", command)
+        self.core.exec(command)
+
+    def when_log_search_input_returnPressed(self):
+        text = self.log_search_input.text().strip()
+        if not text:
+            return
+        query, since, until = parse_search_text(text)
+        self.core.request_log_search(
+            query,
+            since,
+            until,
+            self.log_search_limit,
+            lambda results: self.when_log_search_done(text, results),
+        )
+
+    def when_log_search_done(self, text, results):
+        formatted_lines = []
+        for timestamp, line in results:
+            line = f"{datetime.datetime.fromtimestamp(timestamp):%Y-%m-%d} {line}"
+            format = self.formatter.classify(line)
+            formatted_lines.append((line, format or self.formatter.fallback_format))
+        self.log_search_results.clear()
+        self.log_search_results.write_lines(formatted_lines)
+        title = f"Log Search: {text} ({len(results)} lines)"
+        if self.name != None:
+            title = f"{self.name} - {title}"
+        self.log_search_results.setWindowTitle(title)
+        self.log_search_results.show()
+        self.log_search_results.activateWindow()
+        self.log_search_results.raise_()
+
+    def when_about_to_quit(self):
+        self.sig_out.disconnect()
+        self.log_search_results.close()
+
+    def write_cmdl(self, output):
+        self.write_cmdl_lines(output.splitlines())
+
+    def write_cmdl_lines(self, lines):
+        formatted_lines = []
+        for line in lines:
+            format = self.formatter.classify(line)
+            if format is not None:
+                formatted_lines.append((line, format))
+        if formatted_lines:
+            self.cmdl.write_lines(formatted_lines)
+
+    def out(self, role, flag, line):
+        current_time = datetime.datetime.now().strftime(self.timestamp_format)
+        self.sig_out.emit(f"[{current_time}] [{role}/{flag}]: {line}")
+
+    def cmdl_output_catcher(self,line):
+        self.write_cmdl(line)
+
+    def cmdl_lines_catcher(self,lines):
+        self.write_cmdl_lines(lines)
+
+
+class UI(QWidget):
+    def __init__(self,settings,cores):
+        super().__init__()
+
+        self.stylesheet_path=settings.get('stylesheet', 'styles/MacOS.qss')
+        self.ui_font=settings.get('font', 'Arial')
+        self.ui_font_size=settings.get('font_size', 12)
+        self.tray_icon_path=settings.get('tray_icon', 'res/minecraft_icon.ico')
+        self.window_icon_path=settings.get('window_icon', 'res/minecraft_icon.ico')
+        self.formatter=Console_Formatter(
+            settings.get('cmdl_colormap', {}), settings.get('cmdl_output_exclude', [])
+        )
+        self.panels=[
+            Instance_Panel(settings, core, self.formatter, name) for name, core in cores
+        ]
+
+        self.init_ui()
+        self.init_tray_icon()
+
+    def init_ui(self):
+        with open(self.stylesheet_path, encoding="utf-8") as f:
+            qss_str = f.read()
+        self.setStyleSheet(qss_str)
+        font = QtGui.QFont(
+            self.ui_font, self.ui_font_size, italic=True
+        )
+        QApplication.instance().setFont(font)
+
+        layout = QVBoxLayout()
+        if len(self.panels) == 1:
+            layout.addWidget(self.panels[0])
+        else:
+            self.tabs = QTabWidget(self)
+            for panel in self.panels:
+                self.tabs.addTab(panel, panel.name)
+            layout.addWidget(self.tabs)
 
         self.setLayout(layout)
         self.setWindowIcon(QtGui.QIcon(self.window_icon_path))
@@ -117,19 +252,6 @@ class UI(QWidget):
         self.tray_icon.setIcon(QtGui.QIcon(self.tray_icon_path))
         self.tray_icon.setVisible(True)
 
-    def when_server_info_updated(self):
-        if self.core.server.is_running:
-            run_time = datetime.datetime.now() - self.core.server.start_time
-            run_time_str = str(run_time).split(".")[0]
-            self.server_info_label.setText(
-                f"Server Uptime: {run_time_str}\n"
-                f"CPU Usage: {self.core.server.cpu_usage:.2f}%\n"
-                f"Memory Usage: {self.core.server.memory_usage:.2f} MB\n"
-                f"Players Online: {self.core.server.player_count}"
-            )
-        else:
-            self.server_info_label.setText("Server is not running")
-
     def when_tray_icon_activated(self, reason):
         if reason == QSystemTrayIcon.Trigger:
             if self.isVisible():
@@ -137,12 +259,6 @@ class UI(QWidget):
             else:
                 self.when_show_action_triggered()
 
-    def when_cmdl_input_returnPressed(self):
-        command = self.cmdl_input.text()
-        self.cmdl_input.clear()
-        self.out(USER_ROLE, "INFO", command)
-        self.core.exec(command)
-
     def when_close_button_clicked(self, event):
         event.ignore()
         self.hide()
@@ -151,8 +267,8 @@ class UI(QWidget):
         QApplication.instance().quit()
 
     def when_about_to_quit(self):
-        self.core.when_about_to_quit()
-        self.sig_out.disconnect()
+        for panel in self.panels:
+            panel.when_about_to_quit()
         self.tray_icon.hide()
         self.close()
 
@@ -160,38 +276,3 @@ class UI(QWidget):
         self.show()
         self.activateWindow()
         self.raise_()
-
-    def write_cmdl(self, output):
-        color_map={}
-        for key, value in self.colormap.items():
-            color_map[key]=QtGui.QColor(value)
-        lines = output.splitlines()
-        cursor = self.cmdl.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        for line in lines:
-            color = color_map.get(next((k for k in color_map if k in line), "__fallback__"), QtGui.QColor("black"))
-            format = QtGui.QTextCharFormat()
-            format.setForeground(color)
-            cursor.insertText(line + "\n", format)
-        self.cmdl.setTextCursor(cursor)
-
-    def write_ingame(self,output):
-        for line in output.splitlines():
-            self.core.server.server_exec_silent(f"say {line}")
-
-    def out(self, role, flag, line):
-        current_time = datetime.datetime.now().strftime(self.timestamp_format)
-        self.sig_out.emit(f"[{current_time}] [{role}/{flag}]: {line}")
-
-    def cmdl_output_filter(self, line):
-        for frag in self.output_exclude:
-            if frag in line:
-                return False
-        return True
-
-    def cmdl_output_catcher(self,line):
-        if self.cmdl_output_filter(line):
-            self.write_cmdl(line)
-
-    def ingame_output_catcher(self,line):
-        self.write_ingame(line)
@@ -1,48 +1,154 @@
-from PyQt5.QtCore import pyqtSignal,QEventLoop,QObject
+import codecs
+import re
+import subprocess
+from PyQt5.QtCore import pyqtSignal,QObject,QTimer
 
-class Wait_for_a_Specific_Output(QObject):
-    def __init__(self,sig_out,filter):
+CREATE_NO_WINDOW=getattr(subprocess,"CREATE_NO_WINDOW",0)
+BELOW_NORMAL_PRIORITY_CLASS=getattr(subprocess,"BELOW_NORMAL_PRIORITY_CLASS",0)
+
+def is_positive_int(value):
+    return isinstance(value,int) and not isinstance(value,bool) and value>0
+
+class Output_Dispatcher(QObject):
+    def __init__(self):
         super().__init__()
-        self.loop=QEventLoop()
-        self.result=None
-        self.filter=filter
-        self.sig_out=sig_out
-        self.sig_out.connect(self.judge)
-    def judge(self,line):
-        if self.filter(line):
+        self.subscriptions={}
+        self.next_handle=0
+        self.matcher=None
+        self.compiled=[]
+        self.dirty=False
+    def subscribe(self,pattern,callback,regex=False):
+        if regex:
+            re.compile(pattern)
+        handle=self.next_handle
+        self.next_handle+=1
+        self.subscriptions[handle]=(pattern,regex,callback)
+        self.dirty=True
+        return handle
+    def unsubscribe(self,handle):
+        if self.subscriptions.pop(handle,None) is not None:
+            self.dirty=True
+    def compile(self):
+        groups={}
+        for handle,(pattern,regex,callback) in self.subscriptions.items():
+            source=pattern if regex else re.escape(pattern)
+            groups.setdefault(source,[]).append(handle)
+        self.compiled=[(re.compile(source),handles) for source,handles in groups.items()]
+        if len(self.compiled)>1:
             try:
-                self.sig_out.disconnect(self.judge)
-            except TypeError:
-                pass
-            self.result=line
-            self.loop.quit()
+                self.matcher=re.compile("|".join(f"(?:{source})" for source in groups))
+            except re.error:
+                self.matcher=None
+        elif self.compiled:
+            self.matcher=self.compiled[0][0]
+        else:
+            self.matcher=None
+        self.dirty=False
+    def dispatch(self,lines):
+        if self.dirty:
+            self.compile()
+        if not self.compiled:
+            return
+        search=None if self.matcher is None else self.matcher.search
+        compiled=self.compiled
+        single=len(compiled)==1
+        for line in lines:
+            if search is not None and search(line) is None:
+                continue
+            for pattern,handles in compiled:
+                if single or pattern.search(line):
+                    for handle in handles:
+                        subscription=self.subscriptions.get(handle)
+                        if subscription is not None:
+                            subscription[2](line)
 
 class Listener_for_Specific_Output(QObject):
     sig=pyqtSignal(str)
-    def __init__(self,sig_out,filter):
+    def __init__(self,dispatcher,pattern,regex=False):
         super().__init__()
-        self.filter=filter
-        self.sig_out=sig_out
-    def judge(self,line):
-        if self.filter(line):
-            self.sig.emit(line)
+        self.dispatcher=dispatcher
+        self.pattern=pattern
+        self.regex=regex
+        self.handle=None
     def start(self):
-        self.sig_out.connect(self.judge)
+        if self.handle is None:
+            self.handle=self.dispatcher.subscribe(self.pattern,self.sig.emit,self.regex)
     def stop(self):
-        try:
-            self.sig_out.disconnect(self.judge)
-        except TypeError:
-            pass
+        if self.handle is not None:
+            self.dispatcher.unsubscribe(self.handle)
+            self.handle=None
 
-class Wait_for_a_Signal(QObject):
-    def __init__(self,sig_trigger):
-        super().__init__()
-        self.loop=QEventLoop()
+class Pending_Request(QObject):
+    def __init__(self,parent,callback,timeout):
+        super().__init__(parent)
+        self.callback=callback
+        self.done=False
+        self.result=None
+        self.timer=QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.when_timeout)
+        if timeout is not None:
+            self.timer.start(int(timeout*1000))
+    def when_timeout(self):
+        self.finish(None)
+    def finish(self,result):
+        if self.done:
+            return
+        self.done=True
+        self.result=result
+        self.timer.stop()
+        self.release()
+        if self.callback is not None:
+            self.callback(result)
+        self.deleteLater()
+    def cancel(self):
+        self.callback=None
+        self.finish(None)
+    def finish_soon(self,result=None):
+        QTimer.singleShot(0,lambda: self.finish(result))
+    def release(self):
+        pass
+
+class Output_Request(Pending_Request):
+    def __init__(self,parent,dispatcher,pattern,regex,callback,timeout):
+        super().__init__(parent,callback,timeout)
+        self.dispatcher=dispatcher
+        self.handle=self.dispatcher.subscribe(pattern,self.finish,regex)
+    def release(self):
+        self.dispatcher.unsubscribe(self.handle)
+
+class Signal_Request(Pending_Request):
+    def __init__(self,parent,sig_trigger,callback,timeout):
+        super().__init__(parent,callback,timeout)
         self.sig_trigger=sig_trigger
         self.sig_trigger.connect(self.slot)
-    def slot(self):
+    def slot(self,*args):
+        self.finish(True)
+    def release(self):
         try:
             self.sig_trigger.disconnect(self.slot)
         except TypeError:
             pass
-        self.loop.quit()
\ No newline at end of file
+
+class Line_Framer:
+    def __init__(self, encoding="utf-8", max_line_length=65536):
+        self.encoding=encoding
+        self.max_line_length=max_line_length
+        self.reset()
+    def reset(self):
+        self.decoder=codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        self.partial=""
+    def feed(self,data):
+        text=self.partial+self.decoder.decode(data)
+        lines=text.split("\n")
+        self.partial=lines.pop()
+        if len(self.partial)>self.max_line_length:
+            lines.append(self.partial)
+            self.partial=""
+        return [line.rstrip("\r") for line in lines]
+    def flush(self):
+        text=self.partial+self.decoder.decode(b"",final=True)
+        self.partial=""
+        if text:
+            return [text.rstrip("\r")]
+        return []